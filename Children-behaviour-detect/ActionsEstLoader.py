@@ -4,6 +4,8 @@ import numpy as np
 
 from Actionsrecognition.Models import TwoStreamSpatialTemporalGraph
 from pose_utils import normalize_points_with_size, scale_pose
+from precision import Precision
+from quantization import quantize_static, load_quantized, quantized_weight_file
 
 
 class TSSTG(object):
@@ -11,19 +13,30 @@ class TSSTG(object):
     Args:
         weight_file: (str) Path to trained weights file.
         device: (str) Device to load the model on 'cpu' or 'cuda'.
+        precision: (str) Inference precision and memory format, one of `precision.PRECISIONS`.
+        quantized: (bool) Load the INT8 model saved by `quantize` next to `weight_file`, CPU only.
     """
     def __init__(self,
                  weight_file='./Models/TSSTG/tsstg-model.pth',
-                 device='cpu'):
+                 device='cpu',
+                 precision='fp32',
+                 quantized=False):
         self.graph_args = {'strategy': 'spatial'}
         self.class_names = ['Standing', 'Walking', 'Sitting', 'Lying Down',
                             'Stand up', 'Sit down', 'Fall Down']
         self.num_class = len(self.class_names)
         self.device = device
+        self.weight_file = weight_file
 
         self.model = TwoStreamSpatialTemporalGraph(self.graph_args, self.num_class).to(self.device)
         self.model.load_state_dict(torch.load(weight_file, map_location="cpu"))
         self.model.eval()
+        if quantized:
+            assert device == 'cpu' and precision == 'fp32', 'INT8 model only runs on cpu in fp32!'
+            self.model = load_quantized(self.model, self.preprocess([np.random.rand(30, 13, 3)], (1, 1)),
+                                        quantized_weight_file(weight_file))
+        self.precision = Precision(precision, device)
+        self.model = self.precision.prepare_model(self.model)
 
     def predict(self, pts, image_size):
         """Predict actions from single person skeleton points and score in time sequence.
@@ -36,17 +49,129 @@ class TSSTG(object):
         Returns:
             (numpy array) Probability of each class actions.
         """
-        pts[:, :, :2] = normalize_points_with_size(pts[:, :, :2], image_size[0], image_size[1])
-        pts[:, :, :2] = scale_pose(pts[:, :, :2])
-        pts = np.concatenate((pts, np.expand_dims((pts[:, 1, :] + pts[:, 2, :]) / 2, 1)), axis=1)
+        return self.predict_batch([pts], image_size)
+
+    def predict_batch(self, list_of_pts, image_size):
+        """Predict actions of several persons at once with a single forward pass.
+        Args:
+            list_of_pts: (list of numpy array) points and score of each person in
+                shape `(t, v, c)`, all with the same `t` and `v`.
+            image_size: (tuple of int) width, height of image frame.
+        Returns:
+            (numpy array) Probability of each class actions in shape `(n, num_class)`.
+        """
+        if len(list_of_pts) == 0:
+            return np.zeros((0, self.num_class), dtype=np.float32)
+
+        pts, mot = self.preprocess(list_of_pts, image_size)
+        mot = self.precision.prepare_input(mot.to(self.device))
+        pts = self.precision.prepare_input(pts.to(self.device))
+
+        with torch.no_grad(), self.precision.autocast():
+            out = self.model((pts, mot))
+
+        return out.float().cpu().numpy()
+
+    def preprocess(self, list_of_pts, image_size):
+        """Model inputs of the skeleton sequences of `predict_batch`.
+        Returns:
+            (tuple of torch.float32) Points in shape `(n, c, t, v + 1)` with the neck
+                added, and their motion in shape `(n, 2, t - 1, v + 1)`.
+        """
+        pts = np.stack(list_of_pts).astype(np.float32)
+        pts[..., :2] = normalize_points_with_size(pts[..., :2], image_size[0], image_size[1])
+        pts[..., :2] = scale_pose(pts[..., :2])
+        pts = np.concatenate((pts, np.expand_dims((pts[:, :, 1, :] + pts[:, :, 2, :]) / 2, 2)), axis=2)
 
         pts = torch.tensor(pts, dtype=torch.float32)
-        pts = pts.permute(2, 0, 1)[None, :]
+        pts = pts.permute(0, 3, 1, 2)
 
         mot = pts[:, :2, 1:, :] - pts[:, :2, :-1, :]
-        mot = mot.to(self.device)
-        pts = pts.to(self.device)
+        return pts, mot
+
+    def quantize(self, list_of_pts, image_size, batch_size=8):
+        """Calibrate and save the INT8 model, which `quantized=True` then loads.
+        Args:
+            list_of_pts: (list of numpy array) Recorded skeleton sequences as in `predict_batch`.
+            image_size: (tuple of int) width, height of their image frame.
+            batch_size: (int) Sequences per calibration batch.
+        Returns:
+            (str) Path of the saved INT8 state dict.
+        """
+        calib_inputs = [self.preprocess(list_of_pts[i:i + batch_size], image_size)
+                        for i in range(0, len(list_of_pts), batch_size)]
+        assert self.device == 'cpu', 'Quantize on a cpu model!'
+        quantized = quantize_static(self.model, calib_inputs)
+        weight_file = quantized_weight_file(self.weight_file)
+        torch.save(quantized.state_dict(), weight_file)
+        return weight_file
+
+
+class ActionScheduler(object):
+    """Run the action model of each track only every `stride` frames and keep
+    its last scores in `track.actions` in between. The runs are staggered by
+    track id so the load stays about the same on every frame, and a track whose
+    keypoints moved fast since its last run is run at once.
+    Args:
+        action_model: (TSSTG) Action model to run.
+        stride: (int) Frames between two runs of the same track, 1 to run every frame.
+        motion_thres: (float) Mean keypoints displacement since the last run,
+            relative to the person height, above which a track is run at once.
+            None to never force a run.
+        window: (int) Number of keypoints time steps the model takes.
+    """
+    def __init__(self, action_model, stride=4, motion_thres=0.15, window=30):
+        assert stride >= 1, 'stride must be at least 1!'
+        self.action_model = action_model
+        self.stride = stride
+        self.motion_thres = motion_thres
+        self.window = window
+
+        self.frame = 0
+        # track_id -> keypoints of the latest frame at its last run.
+        self.last_pts = {}
+        self.runs = 0
+        self.forced = 0
+
+    def motion(self, pts, last_pts):
+        """Mean displacement of the keypoints `(v, c)` from `last_pts`, relative
+        to the person height.
+        """
+        height = max(np.ptp(pts[:, 1]), 1.)
+        return np.linalg.norm(pts[:, :2] - last_pts[:, :2], axis=1).mean() / height
+
+    def update(self, tracks, image_size):
+        """Predict the actions of the confirmed tracks due on this frame.
+        Args:
+            tracks: (list of Track) Current tracks of the tracker.
+            image_size: (tuple of int) width, height of image frame.
+        Returns:
+            (list of Track) Tracks whose `actions` were updated.
+        """
+        due = []
+        for track in tracks:
+            if not track.is_confirmed() or len(track.keypoints_list) < self.window:
+                continue
+            last_pts = self.last_pts.get(track.track_id)
+            if last_pts is None or track.actions is None:
+                due.append(track)
+            elif (self.frame + track.track_id) % self.stride == 0:
+                due.append(track)
+            elif self.motion_thres is not None and \
+                    self.motion(track.keypoints_list[-1], last_pts) > self.motion_thres:
+                due.append(track)
+                self.forced += 1
+
+        outs = self.action_model.predict_batch(
+            [track.keypoints_list.window()[-self.window:] for track in due], image_size)
+        for track, out in zip(due, outs):
+            track.actions = out[None]
+            self.last_pts[track.track_id] = track.keypoints_list[-1].copy()
 
-        out = self.model((pts, mot))
+        alive = {track.track_id for track in tracks}
+        for track_id in [i for i in self.last_pts if i not in alive]:
+            del self.last_pts[track_id]
 
-        return out.detach().cpu().numpy()
+        self.runs += len(due)
+        self.frame += 1
+        return due
@@ -1,14 +1,13 @@
 import os
 import cv2
 import time
-import torch
 import screeninfo
 import numpy as np
 import tkinter as tk
 import matplotlib.pyplot as plt
 from PIL import Image, ImageTk
 
-from Detection.Utils import ResizePadding
+from Detection.Utils import ResizePadding, merge_track_boxes
 from CameraLoader import CamLoader, CamLoader_Q
 from DetectorLoader import TinyYOLOv3_onecls
 
@@ -16,7 +15,7 @@ from PoseEstimateLoader import SPPE_FastPose
 from fn import draw_single
 
 from Track.Tracker import Detection, Tracker
-from ActionsEstLoader import TSSTG
+from ActionsEstLoader import TSSTG, ActionScheduler
 
 import matplotlib
 matplotlib.use('TkAgg')
@@ -40,15 +39,18 @@ class Models:
         self.show_detected = True
         self.show_skeleton = True
         self.device = 'cuda'
+        self.action_stride = 4
+        self.precision = 'fp32'
 
         self.load_models()
 
     def load_models(self):
-        self.detect_model = TinyYOLOv3_onecls(self.inp_dets, device=self.device)
+        self.detect_model = TinyYOLOv3_onecls(self.inp_dets, device=self.device, precision=self.precision)
         self.pose_model = SPPE_FastPose(self.pose_backbone, self.inp_pose[0], self.inp_pose[1],
-                                        device=self.device)
+                                        device=self.device, precision=self.precision)
         self.tracker = Tracker(30, n_init=3)
-        self.action_model = TSSTG(device=self.device)
+        self.action_model = TSSTG(device=self.device, precision=self.precision)
+        self.action_scheduler = ActionScheduler(self.action_model, self.action_stride)
 
     def kpt2bbox(self, kpt, ex=20):
         return np.array((kpt[:, 0].min() - ex, kpt[:, 1].min() - ex,
@@ -58,9 +60,7 @@ class Models:
         detected = self.detect_model.detect(frame, need_resize=False, expand_bb=10)
 
         self.tracker.predict()
-        for track in self.tracker.tracks:
-            det = torch.tensor([track.to_tlbr().tolist() + [1.0, 1.0, 0.0]], dtype=torch.float32)
-            detected = torch.cat([detected, det], dim=0) if detected is not None else det
+        detected = merge_track_boxes(detected, [track.to_tlbr() for track in self.tracker.tracks])
 
         detections = []
         if detected is not None:
@@ -74,6 +74,9 @@ class Models:
                     frame = cv2.rectangle(frame, (bb[0], bb[1]), (bb[2], bb[3]), (0, 0, 255), 1)
 
         self.tracker.update(detections)
+
+        self.action_scheduler.update(self.tracker.tracks, frame.shape[:2])
+
         for i, track in enumerate(self.tracker.tracks):
             if not track.is_confirmed():
                 continue
@@ -84,8 +87,7 @@ class Models:
             action = 'pending..'
             clr = (0, 255, 0)
             if len(track.keypoints_list) == 30:
-                pts = np.array(track.keypoints_list, dtype=np.float32)
-                out = self.action_model.predict(pts, frame.shape[:2])
+                out = track.actions
                 action_name = self.action_model.class_names[out[0].argmax()]
                 action = '{}: {:.2f}%'.format(action_name, out[0].max() * 100)
                 if action_name == 'Fall Down':
@@ -93,8 +95,6 @@ class Models:
                 elif action_name == 'Lying Down':
                     clr = (255, 200, 0)
 
-                track.actions = out
-
             if track.time_since_update == 0:
                 if self.show_skeleton:
                     frame = draw_single(frame, track.keypoints_list[-1])
@@ -156,24 +156,26 @@ class main:
         if len(self.models.tracker.tracks) == 0:
             return
         track = self.models.tracker.tracks[0]
-        if hasattr(track, 'actions'):
+        if track.actions is not None:
             y_labels = self.models.action_model.class_names
-            self.ax.barh(np.arange(len(y_labels)), track.actions)
+            self.ax.barh(np.arange(len(y_labels)), track.actions[0])
         self.fig_canvas.draw()
 
     def update(self):
         if self.cam is None:
             return
+        frame = None
         if self.cam.grabbed():
-            frame = self.cam.getitem()
-
+            # Do not wait for the video decoder on the Tk thread, a late frame is shown next time.
+            frame = self.cam.getitem(timeout=0) if isinstance(self.cam, CamLoader_Q) else self.cam.getitem()
+        if frame is not None:
             frame = self.models.process_frame(frame)
 
             frame = cv2.resize(frame, (self.canvas.winfo_width(), self.canvas.winfo_height()),
                                interpolation=cv2.INTER_CUBIC)
             self.photo = ImageTk.PhotoImage(image=Image.fromarray(frame))
             self.canvas.create_image(0, 0, image=self.photo, anchor=tk.NW)
-        else:
+        elif not self.cam.grabbed():
             self.cam.stop()
 
         self._cam = self.master.after(self.delay, self.update)
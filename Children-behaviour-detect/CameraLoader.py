@@ -4,7 +4,7 @@ import time
 import torch
 import numpy as np
 
-from queue import Queue
+from queue import Queue, Full, Empty
 from threading import Thread, Lock
 
 
@@ -12,13 +12,21 @@ class CamLoader:
     """Use threading to capture a frame from camera for faster frame load.
     Recommend for camera or webcam.
 
+    With `ring_size` the frames are captured into a ring of preallocated slots
+    instead. Only the frames that are read get preprocessed, the others are skipped
+    and counted in `frames_dropped`. The original frame is returned as a read-only
+    view of its slot, which stays valid until the next `getitem` call.
+
     Args:
         camera: (int, str) Source of camera or video.,
-        preprocess: (Callable function) to process the frame before return.
+        preprocess: (Callable function) to process the frame before return.,
+        ori_return: (bool) Also return the original frame.,
+        ring_size: (int) Number of ring buffer slots, 0 to copy every frame. Default: 0
     """
-    def __init__(self, camera, preprocess=None, ori_return=False):
+    def __init__(self, camera, preprocess=None, ori_return=False, ring_size=0):
         self.stream = cv2.VideoCapture(camera)
         assert self.stream.isOpened(), 'Cannot read camera source!'
+        assert ring_size == 0 or ring_size >= 3, 'ring_size must be 0 or at least 3!'
         self.fps = self.stream.get(cv2.CAP_PROP_FPS)
         self.frame_size = (int(self.stream.get(cv2.CAP_PROP_FRAME_WIDTH)),
                            int(self.stream.get(cv2.CAP_PROP_FRAME_HEIGHT)))
@@ -32,8 +40,19 @@ class CamLoader:
 
         self.preprocess_fn = preprocess
 
+        # Ring buffer, slots are allocated with the first captured frame.
+        self.ring_size = ring_size
+        self.slots = None
+        self.slot_seq = [-1] * ring_size
+        self.latest = None
+        self.leased = None
+        self.seq = -1
+        self.consumed = False
+        self.frames_dropped = 0
+
     def start(self):
-        self.t = Thread(target=self.update, args=())  # , daemon=True)
+        target = self.update_ring if self.ring_size else self.update
+        self.t = Thread(target=target, args=())  # , daemon=True)
         self.t.start()
         time.sleep(0.5)
         return self
@@ -46,23 +65,85 @@ class CamLoader:
             if ret and self.preprocess_fn is not None:
                 frame = self.preprocess_fn(frame)
 
+            if self.frame is not None and not self.consumed:
+                self.frames_dropped += 1
             self.ret, self.frame = ret, frame
+            self.consumed = False
             self.read_lock.release()
 
+    def update_ring(self):
+        captured = 0
+        idx = 0
+        while not self.stopped:
+            with self.read_lock:
+                # Never write into the slot being read or the newest complete one.
+                while idx == self.leased or idx == self.latest:
+                    idx = (idx + 1) % self.ring_size
+
+            if self.slots is None:
+                ret, frame = self.stream.read()
+                if ret:
+                    self.slots = np.empty((self.ring_size,) + frame.shape, dtype=frame.dtype)
+                    self.slots[idx] = frame
+            else:
+                slot = self.slots[idx]
+                ret, frame = self.stream.read(slot)
+                if ret and frame.ctypes.data != slot.ctypes.data:
+                    slot[...] = frame
+
+            with self.read_lock:
+                if not ret:
+                    self.ret = False
+                    return
+                self.slot_seq[idx] = captured
+                self.latest = idx
+            captured += 1
+            idx = (idx + 1) % self.ring_size
+
     def grabbed(self):
         """Return `True` if can read a frame."""
         return self.ret
 
     def getitem(self):
+        if self.ring_size:
+            return self.getitem_ring()
+
         self.read_lock.acquire()
         frame = self.frame.copy()
         ori_frame = self.ori_frame.copy()
+        self.consumed = True
         self.read_lock.release()
         if self.ori:
             return frame, ori_frame
         else:
             return frame
 
+    def getitem_ring(self):
+        while self.latest is None and self.ret:
+            time.sleep(0.01)
+        if self.latest is None:
+            return (None, None) if self.ori else None
+
+        self.read_lock.acquire()
+        idx = self.latest
+        seq = self.slot_seq[idx]
+        self.leased = idx
+        self.read_lock.release()
+
+        ori_frame = self.slots[idx].view()
+        ori_frame.flags.writeable = False
+        if seq != self.seq:
+            self.frames_dropped += max(0, seq - self.seq - 1)
+            self.seq = seq
+            if self.preprocess_fn is not None:
+                self.frame = self.preprocess_fn(ori_frame)
+            else:
+                self.frame = ori_frame
+        if self.ori:
+            return self.frame, ori_frame
+        else:
+            return self.frame
+
     def stop(self):
         if self.stopped:
             return
@@ -84,23 +165,42 @@ class CamLoader_Q:
     """Use threading and queue to capture a frame and store to queue for pickup in sequence.
     Recommend for video file.
 
+    Frames are decoded into batches of preallocated `(B, H, W, 3)` arrays that are
+    recycled once read. A batch handed out by `getitem` stays valid until the next call.
+
     Args:
         camera: (int, str) Source of camera or video.,
         batch_size: (int) Number of batch frame to store in queue. Default: 1,
         queue_size: (int) Maximum queue size. Default: 256,
-        preprocess: (Callable function) to process the frame before return.
+        preprocess: (Callable function) to process the frame before return.,
+        policy: (str) What to do when the queue is full, 'block' waits for the reader,
+            'drop_oldest' drops the oldest queued batch and 'drop_newest' the new one.
+            Default: 'block'
     """
-    def __init__(self, camera, batch_size=1, queue_size=256, preprocess=None):
+    policies = ('block', 'drop_oldest', 'drop_newest')
+
+    def __init__(self, camera, batch_size=1, queue_size=256, preprocess=None, policy='block'):
         self.stream = cv2.VideoCapture(camera)
         assert self.stream.isOpened(), 'Cannot read camera source!'
+        assert policy in self.policies, '{} policy is not support!'.format(policy)
         self.fps = self.stream.get(cv2.CAP_PROP_FPS)
         self.frame_size = (int(self.stream.get(cv2.CAP_PROP_FRAME_WIDTH)),
                            int(self.stream.get(cv2.CAP_PROP_FRAME_HEIGHT)))
 
         # Queue for storing each frames.
         self.stopped = False
+        self.ended = False
         self.batch_size = batch_size
+        self.policy = policy
         self.Q = Queue(maxsize=queue_size)
+        self.frames_dropped = 0
+
+        # Batch buffers, allocated on demand up to one per queue entry plus the one
+        # being filled and the one leased to the reader.
+        self.free = Queue()
+        self.num_buffers = 0
+        self.max_buffers = queue_size + 2
+        self.leased = None
 
         self.preprocess_fn = preprocess
 
@@ -109,33 +209,86 @@ class CamLoader_Q:
         time.sleep(0.5)
         return self
 
+    def get_buffer(self, frame):
+        if self.free.empty() and self.num_buffers < self.max_buffers:
+            self.num_buffers += 1
+            return np.empty((self.batch_size,) + frame.shape, dtype=frame.dtype)
+        return self.free.get()
+
     def update(self):
         while not self.stopped:
-            if not self.Q.full():
-                frames = []
-                for k in range(self.batch_size):
-                    ret, frame = self.stream.read()
-                    if not ret:
-                        self.stop()
-                        return
-
-                    if self.preprocess_fn is not None:
-                        frame = self.preprocess_fn(frame)
-
-                    frames.append(frame)
-                    frames = np.stack(frames)
-                    self.Q.put(frames)
-            else:
-                with self.Q.mutex:
-                    self.Q.queue.clear()
-            #time.sleep(0.05)
+            batch = None
+            k = 0
+            while k < self.batch_size:
+                ret, frame = self.stream.read()
+                if not ret:
+                    break
+
+                if self.preprocess_fn is not None:
+                    frame = self.preprocess_fn(frame)
+
+                if batch is None:
+                    batch = self.get_buffer(frame)
+                batch[k] = frame
+                k += 1
+
+            if batch is not None:
+                self.put(batch, k)
+            if k < self.batch_size:
+                self.put(None, 0)
+                return
+
+    def put(self, batch, k):
+        item = (batch, k)
+        if batch is None or self.policy == 'block':
+            while not self.stopped:
+                try:
+                    self.Q.put(item, timeout=0.1)
+                    return
+                except Full:
+                    pass
+            return
+
+        try:
+            self.Q.put_nowait(item)
+        except Full:
+            if self.policy == 'drop_newest':
+                self.frames_dropped += k
+                self.free.put(batch)
+                return
+            try:
+                old_batch, old_k = self.Q.get_nowait()
+                self.frames_dropped += old_k
+                if old_batch is not None:
+                    self.free.put(old_batch)
+            except Empty:
+                pass
+            self.Q.put(item)
 
     def grabbed(self):
         """Return `True` if can read a frame."""
-        return self.Q.qsize() > 0
-
-    def getitem(self):
-        return self.Q.get().squeeze()
+        return not self.ended
+
+    def getitem(self, timeout=None):
+        """Return the next frame, or batch of frames when `batch_size > 1`, in order.
+        Returns `None` when the video has ended. Waits for the next frame, or at most
+        `timeout` seconds (0 to not wait) and then returns `None` with `grabbed()` still `True`.
+        """
+        if self.leased is not None:
+            self.free.put(self.leased)
+            self.leased = None
+
+        try:
+            batch, k = self.Q.get(timeout=timeout)
+        except Empty:
+            return None
+        if batch is None:
+            self.ended = True
+            return None
+        self.leased = batch
+        if self.batch_size == 1:
+            return batch[0]
+        return batch[:k]
 
     def stop(self):
         if self.stopped:
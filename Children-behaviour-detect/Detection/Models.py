@@ -1,3 +1,4 @@
+import copy
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -109,18 +110,34 @@ class YOLOLayer(nn.Module):
         self.metrics = {}
         self.img_dim = img_dim
         self.grid_size = 0  # grid size
-
-    def compute_grid_offsets(self, grid_size, cuda=True):
+        self.grid_cache = {}  # (grid_size, device, img_dim) -> grid offsets and anchors
+
+    def compute_grid_offsets(self, grid_size, cuda=True, device=None):
+        if device is None:
+            device = torch.device('cuda' if cuda else 'cpu')
+        key = (grid_size, device, self.img_dim)
+        if key not in self.grid_cache:
+            g = grid_size
+            stride = self.img_dim / grid_size
+            # Calculate offsets for each grid
+            grid_x = torch.arange(g, device=device).repeat(g, 1).view([1, 1, g, g]).float()
+            grid_y = torch.arange(g, device=device).repeat(g, 1).t().view([1, 1, g, g]).float()
+            anchors = torch.tensor(self.anchors, dtype=torch.float32, device=device)
+            scaled_anchors = anchors / stride
+            self.grid_cache[key] = {
+                'stride': stride,
+                'grid_x': grid_x,
+                'grid_y': grid_y,
+                'scaled_anchors': scaled_anchors,
+                'anchor_w': scaled_anchors[:, 0:1].view((1, self.num_anchors, 1, 1)),
+                'anchor_h': scaled_anchors[:, 1:2].view((1, self.num_anchors, 1, 1)),
+                # Pixel space grid and anchors for the inference decode.
+                'grid_xy': torch.stack((grid_x, grid_y), -1) * stride,
+                'anchor_wh': anchors.view((1, self.num_anchors, 1, 1, 2)),
+            }
         self.grid_size = grid_size
-        g = self.grid_size
-        FloatTensor = torch.cuda.FloatTensor if cuda else torch.FloatTensor
-        self.stride = self.img_dim / self.grid_size
-        # Calculate offsets for each grid
-        self.grid_x = torch.arange(g).repeat(g, 1).view([1, 1, g, g]).type(FloatTensor)
-        self.grid_y = torch.arange(g).repeat(g, 1).t().view([1, 1, g, g]).type(FloatTensor)
-        self.scaled_anchors = FloatTensor([(a_w / self.stride, a_h / self.stride) for a_w, a_h in self.anchors])
-        self.anchor_w = self.scaled_anchors[:, 0:1].view((1, self.num_anchors, 1, 1))
-        self.anchor_h = self.scaled_anchors[:, 1:2].view((1, self.num_anchors, 1, 1))
+        for name, value in self.grid_cache[key].items():
+            setattr(self, name, value)
 
     def forward(self, x, targets=None, img_dim=None):
         # Tensors for cuda support
@@ -128,7 +145,6 @@ class YOLOLayer(nn.Module):
         LongTensor = torch.cuda.LongTensor if x.is_cuda else torch.LongTensor
         ByteTensor = torch.cuda.ByteTensor if x.is_cuda else torch.ByteTensor
 
-        self.img_dim = img_dim
         num_samples = x.size(0)
         grid_size = x.size(2)
 
@@ -138,6 +154,23 @@ class YOLOLayer(nn.Module):
             .contiguous()
         )
 
+        # Grid offsets are cached per grid size, device and input size.
+        if grid_size != self.grid_size or img_dim != self.img_dim or x.device != self.grid_x.device:
+            self.img_dim = img_dim
+            self.compute_grid_offsets(grid_size, device=x.device)
+
+        if targets is None:
+            # Inference only: decode straight into the output without the loss tensors.
+            output = torch.cat(
+                (
+                    torch.sigmoid(prediction[..., :2]) * self.stride + self.grid_xy,
+                    torch.exp(prediction[..., 2:4]) * self.anchor_wh,
+                    torch.sigmoid(prediction[..., 4:]),
+                ),
+                -1,
+            )
+            return output.view(num_samples, -1, self.num_classes + 5).detach(), 0
+
         # Get outputs
         x = torch.sigmoid(prediction[..., 0])  # Center x
         y = torch.sigmoid(prediction[..., 1])  # Center y
@@ -146,10 +179,6 @@ class YOLOLayer(nn.Module):
         pred_conf = torch.sigmoid(prediction[..., 4])  # Conf
         pred_cls = torch.sigmoid(prediction[..., 5:])  # Cls pred.
 
-        # If grid size does not match current we compute new offsets
-        if grid_size != self.grid_size:
-            self.compute_grid_offsets(grid_size, cuda=x.is_cuda)
-
         # Add offset and scale with anchors
         pred_boxes = FloatTensor(prediction[..., :4].shape)
         pred_boxes[..., 0] = x.data + self.grid_x
@@ -166,58 +195,55 @@ class YOLOLayer(nn.Module):
             -1,
         )
 
-        if targets is None:
-            return output, 0
-        else:
-            iou_scores, class_mask, obj_mask, noobj_mask, tx, ty, tw, th, tcls, tconf = build_targets(
-                pred_boxes=pred_boxes,
-                pred_cls=pred_cls,
-                target=targets,
-                anchors=self.scaled_anchors,
-                ignore_thres=self.ignore_thres,
-            )
-
-            # Loss : Mask outputs to ignore non-existing objects (except with conf. loss)
-            loss_x = self.mse_loss(x[obj_mask.bool()], tx[obj_mask.bool()])
-            loss_y = self.mse_loss(y[obj_mask.bool()], ty[obj_mask.bool()])
-            loss_w = self.mse_loss(w[obj_mask.bool()], tw[obj_mask.bool()])
-            loss_h = self.mse_loss(h[obj_mask.bool()], th[obj_mask.bool()])
-            loss_conf_obj = self.bce_loss(pred_conf[obj_mask.bool()], tconf[obj_mask.bool()])
-            loss_conf_noobj = self.bce_loss(pred_conf[noobj_mask.bool()], tconf[noobj_mask.bool()])
-            loss_conf = self.obj_scale * loss_conf_obj + self.noobj_scale * loss_conf_noobj
-            loss_cls = self.bce_loss(pred_cls[obj_mask.bool()], tcls[obj_mask.bool()])
-            total_loss = loss_x + loss_y + loss_w + loss_h + loss_conf + loss_cls
-
-            # Metrics
-            cls_acc = 100 * class_mask[obj_mask.bool()].mean()
-            conf_obj = pred_conf[obj_mask.bool()].mean()
-            conf_noobj = pred_conf[noobj_mask.bool()].mean()
-            conf50 = (pred_conf > 0.5).float()
-            iou50 = (iou_scores > 0.5).float()
-            iou75 = (iou_scores > 0.75).float()
-            detected_mask = conf50 * class_mask * tconf
-            precision = torch.sum(iou50 * detected_mask) / (conf50.sum() + 1e-16)
-            recall50 = torch.sum(iou50 * detected_mask) / (obj_mask.sum() + 1e-16)
-            recall75 = torch.sum(iou75 * detected_mask) / (obj_mask.sum() + 1e-16)
-
-            self.metrics = {
-                "loss": to_cpu(total_loss).item(),
-                "x": to_cpu(loss_x).item(),
-                "y": to_cpu(loss_y).item(),
-                "w": to_cpu(loss_w).item(),
-                "h": to_cpu(loss_h).item(),
-                "conf": to_cpu(loss_conf).item(),
-                "cls": to_cpu(loss_cls).item(),
-                "cls_acc": to_cpu(cls_acc).item(),
-                "recall50": to_cpu(recall50).item(),
-                "recall75": to_cpu(recall75).item(),
-                "precision": to_cpu(precision).item(),
-                "conf_obj": to_cpu(conf_obj).item(),
-                "conf_noobj": to_cpu(conf_noobj).item(),
-                "grid_size": grid_size,
-            }
+        iou_scores, class_mask, obj_mask, noobj_mask, tx, ty, tw, th, tcls, tconf = build_targets(
+            pred_boxes=pred_boxes,
+            pred_cls=pred_cls,
+            target=targets,
+            anchors=self.scaled_anchors,
+            ignore_thres=self.ignore_thres,
+        )
 
-            return output, total_loss
+        # Loss : Mask outputs to ignore non-existing objects (except with conf. loss)
+        loss_x = self.mse_loss(x[obj_mask.bool()], tx[obj_mask.bool()])
+        loss_y = self.mse_loss(y[obj_mask.bool()], ty[obj_mask.bool()])
+        loss_w = self.mse_loss(w[obj_mask.bool()], tw[obj_mask.bool()])
+        loss_h = self.mse_loss(h[obj_mask.bool()], th[obj_mask.bool()])
+        loss_conf_obj = self.bce_loss(pred_conf[obj_mask.bool()], tconf[obj_mask.bool()])
+        loss_conf_noobj = self.bce_loss(pred_conf[noobj_mask.bool()], tconf[noobj_mask.bool()])
+        loss_conf = self.obj_scale * loss_conf_obj + self.noobj_scale * loss_conf_noobj
+        loss_cls = self.bce_loss(pred_cls[obj_mask.bool()], tcls[obj_mask.bool()])
+        total_loss = loss_x + loss_y + loss_w + loss_h + loss_conf + loss_cls
+
+        # Metrics
+        cls_acc = 100 * class_mask[obj_mask.bool()].mean()
+        conf_obj = pred_conf[obj_mask.bool()].mean()
+        conf_noobj = pred_conf[noobj_mask.bool()].mean()
+        conf50 = (pred_conf > 0.5).float()
+        iou50 = (iou_scores > 0.5).float()
+        iou75 = (iou_scores > 0.75).float()
+        detected_mask = conf50 * class_mask * tconf
+        precision = torch.sum(iou50 * detected_mask) / (conf50.sum() + 1e-16)
+        recall50 = torch.sum(iou50 * detected_mask) / (obj_mask.sum() + 1e-16)
+        recall75 = torch.sum(iou75 * detected_mask) / (obj_mask.sum() + 1e-16)
+
+        self.metrics = {
+            "loss": to_cpu(total_loss).item(),
+            "x": to_cpu(loss_x).item(),
+            "y": to_cpu(loss_y).item(),
+            "w": to_cpu(loss_w).item(),
+            "h": to_cpu(loss_h).item(),
+            "conf": to_cpu(loss_conf).item(),
+            "cls": to_cpu(loss_cls).item(),
+            "cls_acc": to_cpu(cls_acc).item(),
+            "recall50": to_cpu(recall50).item(),
+            "recall75": to_cpu(recall75).item(),
+            "precision": to_cpu(precision).item(),
+            "conf_obj": to_cpu(conf_obj).item(),
+            "conf_noobj": to_cpu(conf_noobj).item(),
+            "grid_size": grid_size,
+        }
+
+        return output, total_loss
 
 
 class Darknet(nn.Module):
@@ -251,6 +277,10 @@ class Darknet(nn.Module):
         yolo_outputs = to_cpu(torch.cat(yolo_outputs, 1))
         return yolo_outputs if targets is None else (loss, yolo_outputs)
 
+    def optimize_for_inference(self):
+        """Return an inference only copy of the model, see `DarknetInference`."""
+        return DarknetInference(self)
+
     def load_darknet_weights(self, weights_path):
         """Parses and loads the weights stored in 'weights_path'"""
         # Open the weights file
@@ -346,3 +376,76 @@ class Darknet(nn.Module):
                 continue
 
             own_state[name].copy_(param)
+
+
+def fuse_conv_bn(conv, bn):
+    """Fold BatchNorm2d running statistics into the weights and bias of the preceding Conv2d."""
+    fused = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size, stride=conv.stride,
+                      padding=conv.padding, dilation=conv.dilation, groups=conv.groups, bias=True)
+    scale = bn.weight.detach() / torch.sqrt(bn.running_var + bn.eps)
+    bias = conv.bias.detach() if conv.bias is not None else torch.zeros_like(bn.running_mean)
+    fused.weight.data.copy_(conv.weight.detach() * scale.view(-1, 1, 1, 1))
+    fused.bias.data.copy_((bias - bn.running_mean) * scale + bn.bias.detach())
+    return fused.to(conv.weight.device)
+
+
+class DarknetInference(nn.Module):
+    """Lean inference only version of a `Darknet` model with the same outputs.
+    BatchNorm is folded into the convolutions, route and shortcut layers are compiled
+    into index lists once, only the layer outputs used later are kept and the YOLO
+    layers have no loss functions.
+    Args:
+        - darknet: (Darknet) Model to convert, it is left unchanged.
+    """
+    def __init__(self, darknet):
+        super(DarknetInference, self).__init__()
+        self.module_list = nn.ModuleList()
+        self.plan = []  # (type, layer indices) of each layer.
+        for i, (module_def, module) in enumerate(zip(darknet.module_defs, darknet.module_list)):
+            layer_type = module_def["type"]
+            indices = []
+            if layer_type == "convolutional":
+                layers = list(module)
+                if int(module_def["batch_normalize"]):
+                    layers = [fuse_conv_bn(layers[0], layers[1])] + layers[2:]
+                else:
+                    layers = [copy.deepcopy(layer) for layer in layers]
+                module = nn.Sequential(*layers)
+            elif layer_type == "route":
+                indices = [int(x) for x in module_def["layers"].split(",")]
+                indices = [j if j >= 0 else i + j for j in indices]
+                module = nn.Identity()
+            elif layer_type == "shortcut":
+                j = int(module_def["from"])
+                indices = [i - 1, j if j >= 0 else i + j]
+                module = nn.Identity()
+            elif layer_type == "yolo":
+                module = copy.deepcopy(module[0])
+                del module.mse_loss, module.bce_loss
+                module.metrics = {}
+            else:
+                module = copy.deepcopy(module)
+            self.module_list.append(module)
+            self.plan.append((layer_type, indices))
+
+        # Outputs of these layers are read again by a later route or shortcut.
+        self.keep = set(j for _, indices in self.plan for j in indices)
+        self.eval()
+
+    @torch.no_grad()
+    def forward(self, x):
+        img_dim = x.shape[2]
+        layer_outputs, yolo_outputs = {}, []
+        for i, ((layer_type, indices), module) in enumerate(zip(self.plan, self.module_list)):
+            if layer_type == "route":
+                x = torch.cat([layer_outputs[j] for j in indices], 1)
+            elif layer_type == "shortcut":
+                x = layer_outputs[indices[0]] + layer_outputs[indices[1]]
+            elif layer_type == "yolo":
+                x = module(x, img_dim=img_dim)[0]
+                yolo_outputs.append(x)
+            else:
+                x = module(x)
+            if i in self.keep:
+                layer_outputs[i] = x
+        return to_cpu(torch.cat(yolo_outputs, 1))
@@ -219,6 +219,65 @@ def bbox_iou(box1, box2, x1y1x2y2=True):
     return iou
 
 
+def bbox_iou_matrix(box1, box2):
+    """
+    Returns the IoU of every box in box1 (N, 4) against every box in box2 (M, 4) as (N, M),
+    with the same (x1, y1, x2, y2) convention as `bbox_iou`
+    """
+    b1 = box1[:, None, :]
+    b2 = box2[None, :, :]
+    inter_rect_x1 = torch.max(b1[..., 0], b2[..., 0])
+    inter_rect_y1 = torch.max(b1[..., 1], b2[..., 1])
+    inter_rect_x2 = torch.min(b1[..., 2], b2[..., 2])
+    inter_rect_y2 = torch.min(b1[..., 3], b2[..., 3])
+    inter_area = torch.clamp(inter_rect_x2 - inter_rect_x1 + 1, min=0) * torch.clamp(
+        inter_rect_y2 - inter_rect_y1 + 1, min=0
+    )
+    b1_area = (b1[..., 2] - b1[..., 0] + 1) * (b1[..., 3] - b1[..., 1] + 1)
+    b2_area = (b2[..., 2] - b2[..., 0] + 1) * (b2[..., 3] - b2[..., 1] + 1)
+
+    return inter_area / (b1_area + b2_area - inter_area + 1e-16)
+
+
+def weighted_nms(detections, nms_thres, chunk_size=128):
+    """
+    Greedy NMS over detections sorted by score, (x1, y1, x2, y2, object_conf, class_score, class_pred).
+    Every kept box is replaced by the object_conf weighted mean of the boxes it suppresses.
+    The boxes are taken 'chunk_size' at a time in score order, and the IoU of a chunk is only
+    computed against the boxes not suppressed yet, so a crowded image never builds the full N x N matrix.
+    """
+    boxes, labels = detections[:, :4], detections[:, -1]
+    remaining = np.ones(len(detections), dtype=bool)
+    keep, groups = [], []
+    for start in range(0, len(detections), chunk_size):
+        rows = np.flatnonzero(remaining[start:start + chunk_size]) + start
+        if not len(rows):
+            continue
+        # The boxes before the chunk are all kept or suppressed already.
+        cols = np.flatnonzero(remaining)
+        r, c = torch.from_numpy(rows).to(boxes.device), torch.from_numpy(cols).to(boxes.device)
+        overlap = bbox_iou_matrix(boxes[r], boxes[c]) > nms_thres
+        overlap &= labels[r, None] == labels[None, c]
+        overlap = overlap.cpu().numpy()
+
+        left = np.ones(len(cols), dtype=bool)
+        row_cols = np.searchsorted(cols, rows)
+        while left[row_cols].any():
+            i = left[row_cols].argmax()
+            group = overlap[i] & left
+            left &= ~group
+            keep.append(rows[i])
+            groups.append(cols[group])
+        remaining[cols] = left
+
+    members = np.zeros((len(keep), len(detections)), dtype=bool)
+    members[np.repeat(np.arange(len(keep)), [len(g) for g in groups]), np.concatenate(groups)] = True
+    weights = torch.from_numpy(members).to(detections) * detections[:, 4]
+    kept = detections[keep].clone()
+    kept[:, :4] = weights.mm(detections[:, :4]) / weights.sum(1, keepdim=True)
+    return kept
+
+
 def non_max_suppression(prediction, conf_thres=0.5, nms_thres=0.4):
     """
     Removes detections with lower object confidence score than 'conf_thres' and performs
@@ -242,23 +301,34 @@ def non_max_suppression(prediction, conf_thres=0.5, nms_thres=0.4):
         class_confs, class_preds = image_pred[:, 5:].max(1, keepdim=True)
         detections = torch.cat((image_pred[:, :5], class_confs.float(), class_preds.float()), 1)
         # Perform non-maximum suppression
-        keep_boxes = []
-        while detections.size(0):
-            large_overlap = bbox_iou(detections[0, :4].unsqueeze(0), detections[:, :4]) > nms_thres
-            label_match = detections[0, -1] == detections[:, -1]
-            # Indices of boxes with lower confidence scores, large IOUs and matching labels
-            invalid = large_overlap & label_match
-            weights = detections[invalid, 4:5]
-            # Merge overlapping bboxes by order of confidence
-            detections[0, :4] = (weights * detections[invalid, :4]).sum(0) / weights.sum()
-            keep_boxes += [detections[0]]
-            detections = detections[~invalid]
-        if keep_boxes:
-            output[image_i] = torch.stack(keep_boxes)
+        output[image_i] = weighted_nms(detections, nms_thres)
 
     return output
 
 
+def merge_track_boxes(detected, track_boxes, iou_thres=0.5, object_conf=1.0):
+    """
+    Appends to the detections (x1, y1, x2, y2, object_conf, class_score, class_pred) the
+    (x1, y1, x2, y2) boxes of the tracks the detector missed, so a person already
+    detected is not cropped a second time from its track box for pose estimation.
+    A track box is dropped when its IoU with any detection is above 'iou_thres', or when
+    it is empty (a drifting track predicted with a negative width or height).
+    Returns None when there are neither detections nor track boxes.
+    """
+    track_boxes = torch.as_tensor(np.asarray(track_boxes, dtype=np.float32).reshape(-1, 4))
+    track_boxes = track_boxes[(track_boxes[:, 2] > track_boxes[:, 0]) & (track_boxes[:, 3] > track_boxes[:, 1])]
+    if detected is not None and len(detected) and len(track_boxes):
+        iou = bbox_iou_matrix(track_boxes, detected[:, :4].float().cpu())
+        track_boxes = track_boxes[iou.max(1)[0] <= iou_thres]
+    if not len(track_boxes):
+        return detected
+
+    tracks = torch.cat((track_boxes, torch.tensor([[object_conf, 1.0, 0.0]]).repeat(len(track_boxes), 1)), 1)
+    if detected is None:
+        return tracks
+    return torch.cat((detected, tracks.to(detected)), 0)
+
+
 def build_targets(pred_boxes, pred_cls, target, anchors, ignore_thres):
     ByteTensor = torch.cuda.ByteTensor if pred_boxes.is_cuda else torch.ByteTensor
     FloatTensor = torch.cuda.FloatTensor if pred_boxes.is_cuda else torch.FloatTensor
@@ -377,6 +447,20 @@ def ResizePadding(height, width):
     return resizePadding
 
 
+def read_clip(path, size, max_frames):
+    """RGB frames of a recorded clip, resized and padded as in main.py."""
+    resize_fn = ResizePadding(size, size)
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(cv2.cvtColor(resize_fn(frame), cv2.COLOR_BGR2RGB))
+    cap.release()
+    return frames
+
+
 class AverageValueMeter(object):
     def __init__(self):
         self.reset()
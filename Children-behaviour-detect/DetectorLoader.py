@@ -1,13 +1,12 @@
-import time
 import torch
 import numpy as np
-import torchvision.transforms as transforms
 
 from queue import Queue
 from threading import Thread
 
 from Detection.Models import Darknet
 from Detection.Utils import non_max_suppression, ResizePadding
+from precision import Precision
 
 
 class TinyYOLOv3_onecls(object):
@@ -18,7 +17,8 @@ class TinyYOLOv3_onecls(object):
         weight_file: (str) Path to trained weights file.,
         nms: (float) Non-Maximum Suppression overlap threshold.,
         conf_thres: (float) Minimum Confidence threshold of predicted bboxs to cut off.,
-        device: (str) Device to load the model on 'cpu' or 'cuda'.
+        device: (str) Device to load the model on 'cpu' or 'cuda'.,
+        precision: (str) Inference precision and memory format, one of `precision.PRECISIONS`.
     """
     def __init__(self,
                  input_size=416,
@@ -26,18 +26,22 @@ class TinyYOLOv3_onecls(object):
                  weight_file='Models/yolo-tiny-onecls/best-model.pth',
                  nms=0.2,
                  conf_thres=0.45,
-                 device='cuda'):
+                 device='cuda',
+                 precision='fp32'):
         self.input_size = input_size
         self.model = Darknet(config_file).to(device)
         self.model.load_state_dict(torch.load(weight_file, map_location=torch.device('cpu')))
         self.model.eval()
+        # Conv+BN folded, inference only copy of the model.
+        self.model = self.model.optimize_for_inference()
         self.device = device
+        self.precision = Precision(precision, device)
+        self.model = self.precision.prepare_model(self.model)
 
         self.nms = nms
         self.conf_thres = conf_thres
 
         self.resize_fn = ResizePadding(input_size, input_size)
-        self.transf_fn = transforms.ToTensor()
 
     def detect(self, image, need_resize=True, expand_bb=5):
         """Feed forward to the model.
@@ -51,23 +55,44 @@ class TinyYOLOv3_onecls(object):
                 [top, left, bottom, right, bbox_score, class_score, class]
             return `None` if no detected.
         """
-        image_size = (self.input_size, self.input_size)
+        return self.detect_batch([image], need_resize, expand_bb)[0]
+
+    def detect_batch(self, images, need_resize=True, expand_bb=5):
+        """Feed forward a batch of images to the model at once.
+        Args:
+            images: (list or numpy array) RGB images to detect, of shape `(h, w, 3)` each.,
+            need_resize: (bool) Resize to input_size before feed and will return bboxs
+                with scale to each image original size.,
+            expand_bb: (int) Expand boundary of the boxs.
+        Returns:
+            (list) Of `detect` result for each image.
+        """
+        if len(images) == 0:
+            return []
+
+        image_sizes = [(self.input_size, self.input_size)] * len(images)
         if need_resize:
-            image_size = image.shape[:2]
-            image = self.resize_fn(image)
+            image_sizes = [image.shape[:2] for image in images]
+            images = [self.resize_fn(image) for image in images]
+
+        batch = torch.from_numpy(np.ascontiguousarray(np.stack(images)))
+        batch = batch.permute(0, 3, 1, 2).float().div(255)
 
-        image = self.transf_fn(image)[None, ...]
-        scf = torch.min(self.input_size / torch.FloatTensor([image_size]), 1)[0]
+        with torch.no_grad(), self.precision.autocast():
+            detected = self.model(self.precision.prepare_input(batch.to(self.device)))
+        detected = detected.float()
+        detected = non_max_suppression(detected, self.conf_thres, self.nms)
 
-        detected = self.model(image.to(self.device))
-        detected = non_max_suppression(detected, self.conf_thres, self.nms)[0]
-        if detected is not None:
-            detected[:, [0, 2]] -= (self.input_size - scf * image_size[1]) / 2
-            detected[:, [1, 3]] -= (self.input_size - scf * image_size[0]) / 2
-            detected[:, 0:4] /= scf
+        for dets, image_size in zip(detected, image_sizes):
+            if dets is None:
+                continue
+            scf = min(self.input_size / image_size[0], self.input_size / image_size[1])
+            dets[:, [0, 2]] -= (self.input_size - scf * image_size[1]) / 2
+            dets[:, [1, 3]] -= (self.input_size - scf * image_size[0]) / 2
+            dets[:, 0:4] /= scf
 
-            detected[:, 0:2] = np.maximum(0, detected[:, 0:2] - expand_bb)
-            detected[:, 2:4] = np.minimum(image_size[::-1], detected[:, 2:4] + expand_bb)
+            dets[:, 0:2] = np.maximum(0, dets[:, 0:2] - expand_bb)
+            dets[:, 2:4] = np.minimum(image_size[::-1], dets[:, 2:4] + expand_bb)
 
         return detected
 
@@ -93,14 +118,23 @@ class ThreadDetection(object):
                 return
 
             images = self.dataloader.getitem()
-
-            outputs = self.model.detect(images)
-
-            if self.Q.full():
-                time.sleep(2)
+            if images is None:
+                # End of the stream, passed on to the reader.
+                self.stopped = True
+                self.Q.put((None, None))
+                return
+            # Batches from `CamLoader_Q` are reused by the loader once read.
+            images = np.array(images)
+            if images.ndim == 3:
+                outputs = self.model.detect(images)
+            else:
+                outputs = self.model.detect_batch(images)
+
+            # Blocks while the queue is full, until the reader takes the next item.
             self.Q.put((images, outputs))
 
     def getitem(self):
+        """Return the next `(images, detections)`, `(None, None)` when the stream has ended."""
         return self.Q.get()
 
     def stop(self):
@@ -4,8 +4,10 @@ import torch
 
 from SPPE.src.main_fast_inference import InferenNet_fast, InferenNet_fastRes50
 from SPPE.src.utils.img import crop_dets
-from pPose_nms import pose_nms
+from pPose_nms import pose_nms, poses_overlap, pose_nms_disjoint
 from SPPE.src.utils.eval import getPrediction
+from precision import Precision
+from quantization import quantize_static, load_quantized, quantized_weight_file
 
 
 class SPPE_FastPose(object):
@@ -13,7 +15,9 @@ class SPPE_FastPose(object):
                  backbone,
                  input_height=320,
                  input_width=256,
-                 device='cpu'):
+                 device='cpu',
+                 precision='fp32',
+                 quantized=False):
         assert backbone in ['resnet50', 'resnet101'], '{} backbone is not support yet!'.format(backbone)
 
         self.inp_h = input_height
@@ -25,15 +29,47 @@ class SPPE_FastPose(object):
         else:
             self.model = InferenNet_fastRes50().to(device)
         self.model.eval()
+        if quantized:
+            # INT8 model saved by `quantize` next to the float weights.
+            assert device == 'cpu' and precision == 'fp32', 'INT8 model only runs on cpu in fp32!'
+            self.model.pyranet = load_quantized(self.model.pyranet, torch.zeros(1, 3, self.inp_h, self.inp_w),
+                                                quantized_weight_file(self.model.weights_file))
+        self.precision = Precision(precision, device)
+        self.model = self.precision.prepare_model(self.model)
+
+        # Number of predict calls, and of those that skipped pose NMS as no poses overlap.
+        self.nms_calls = 0
+        self.nms_skipped = 0
 
     def predict(self, image, bboxs, bboxs_scores):
         inps, pt1, pt2 = crop_dets(image, bboxs, self.inp_h, self.inp_w)
-        pose_hm = self.model(inps.to(self.device)).cpu().data
+        with torch.no_grad(), self.precision.autocast():
+            pose_hm = self.model(self.precision.prepare_input(inps.to(self.device)))
+        pose_hm = pose_hm.float().contiguous().cpu()
 
         # Cut eyes and ears.
         pose_hm = torch.cat([pose_hm[:, :1, ...], pose_hm[:, 5:, ...]], dim=1)
 
         xy_hm, xy_img, scores = getPrediction(pose_hm, pt1, pt2, self.inp_h, self.inp_w,
                                               pose_hm.shape[-2], pose_hm.shape[-1])
+        self.nms_calls += 1
+        if not poses_overlap(xy_img):
+            self.nms_skipped += 1
+            return pose_nms_disjoint(bboxs, bboxs_scores, xy_img, scores)
+
         result = pose_nms(bboxs, bboxs_scores, xy_img, scores)
-        return result
\ No newline at end of file
+        return result
+
+    def quantize(self, samples):
+        """Calibrate and save the INT8 model, which `quantized=True` then loads.
+        Args:
+            samples: (list of tuple) Recorded `(image, bboxs)` as given to `predict`.
+        Returns:
+            (str) Path of the saved INT8 state dict.
+        """
+        assert self.device == 'cpu', 'Quantize on a cpu model!'
+        calib_inputs = [crop_dets(image, bboxs, self.inp_h, self.inp_w)[0] for image, bboxs in samples]
+        quantized = quantize_static(self.model.pyranet, calib_inputs)
+        weight_file = quantized_weight_file(self.model.weights_file)
+        torch.save(quantized.state_dict(), weight_file)
+        return weight_file
@@ -60,6 +60,7 @@ class InferenNet_fast(nn.Module):
         print('Loading pose model from {}'.format(weights_file))
         self.pyranet.load_state_dict(torch.load(weights_file))
         self.pyranet.eval()
+        self.weights_file = weights_file
 
     def forward(self, x):
         out = self.pyranet(x)
@@ -76,6 +77,7 @@ class InferenNet_fastRes50(nn.Module):
         print('Loading pose model from {}'.format(weights_file))
         self.pyranet.load_state_dict(torch.load(weights_file, map_location="cpu"))
         self.pyranet.eval()
+        self.weights_file = weights_file
 
     def forward(self, x):
         out = self.pyranet(x)
@@ -1,10 +1,9 @@
 import time
 import numpy as np
-from collections import deque
 
-from .linear_assignment import min_cost_matching, matching_cascade
-from .kalman_filter import KalmanFilter
-from .iou_matching import iou_cost
+from .linear_assignment import min_cost_matching, matching_cascade, linear_assignment
+from .kalman_filter import KalmanFilter, KalmanStates
+from .iou_matching import IouCost
 
 
 class TrackState:
@@ -28,6 +27,8 @@ class Detection(object):
         keypoints: (float array) Of shape [node, pts].,
         confidence: (float) Confidence score of detection.
     """
+    __slots__ = ('tlbr', 'keypoints', 'confidence')
+
     def __init__(self, tlbr, keypoints, confidence):
         self.tlbr = tlbr
         self.keypoints = keypoints
@@ -49,10 +50,65 @@ class Detection(object):
         return ret
 
 
+class KeypointsHistory(object):
+    """The last `maxlen` keypoints of a track in a fixed float32 circular buffer.
+    Every entry is written twice, at `i` and `i + maxlen` of a buffer of size
+    2 * maxlen, so the history ordered from oldest to newest is always the one
+    contiguous view `buffer[head:head + count]`.
+
+    Args:
+        maxlen: (int) Number of time steps to keep.
+    """
+    __slots__ = ('maxlen', 'buffer', 'head', 'count')
+
+    def __init__(self, maxlen=30):
+        self.maxlen = maxlen
+        self.buffer = None
+        self.head = 0
+        self.count = 0
+
+    def append(self, keypoints):
+        if self.buffer is None:
+            self.buffer = np.zeros((2 * self.maxlen,) + np.shape(keypoints), dtype=np.float32)
+        i = (self.head + self.count) % self.maxlen
+        self.buffer[i] = keypoints
+        self.buffer[i + self.maxlen] = keypoints
+        if self.count < self.maxlen:
+            self.count += 1
+        else:
+            self.head = (self.head + 1) % self.maxlen
+
+    def window(self):
+        """Get the history as a (count, node, pts) view, oldest first. The view is
+        overwritten by the next `append`, copy it to keep it.
+        """
+        if self.buffer is None:
+            return np.zeros((0,), dtype=np.float32)
+        return self.buffer[self.head:self.head + self.count]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, idx):
+        return self.window()[idx]
+
+    def __iter__(self):
+        return iter(self.window())
+
+    def __array__(self, dtype=None, copy=None):
+        return np.array(self.window(), dtype=dtype)
+
+
 class Track:
-    def __init__(self, mean, covariance, track_id, n_init, max_age=30, buffer=30):
-        self.mean = mean
-        self.covariance = covariance
+    """A single target track. Its mean and covariance are views into a slot of
+    `states`, shared with the other tracks of the same `Tracker`.
+    """
+    __slots__ = ('states', 'slot', 'track_id', 'hist', 'age', 'time_since_update',
+                 'n_init', 'max_age', 'keypoints_list', 'actions', 'state')
+
+    def __init__(self, mean, covariance, track_id, n_init, max_age=30, buffer=30, states=None):
+        self.states = states if states is not None else KalmanStates(1)
+        self.slot = self.states.add(mean, covariance)
         self.track_id = track_id
         self.hist = 1
         self.age = 1
@@ -61,10 +117,28 @@ class Track:
         self.max_age = max_age
 
         # keypoints list for use in Actions prediction.
-        self.keypoints_list = deque(maxlen=buffer)
+        self.keypoints_list = KeypointsHistory(buffer)
+        # Last actions prediction of the keypoints list.
+        self.actions = None
 
         self.state = TrackState.Tentative
 
+    @property
+    def mean(self):
+        return self.states.mean[self.slot]
+
+    @mean.setter
+    def mean(self, value):
+        self.states.mean[self.slot] = value
+
+    @property
+    def covariance(self):
+        return self.states.covariance[self.slot]
+
+    @covariance.setter
+    def covariance(self, value):
+        self.states.covariance[self.slot] = value
+
     def to_tlwh(self):
         ret = self.mean[:4].copy()
         ret[2] *= ret[3]
@@ -84,6 +158,10 @@ class Track:
         Kalman filter prediction step.
         """
         self.mean, self.covariance = kf.predict(self.mean, self.covariance)
+        self.mark_predicted()
+
+    def mark_predicted(self):
+        """Count a time step, after the state is predicted."""
         self.age += 1
         self.time_since_update += 1
 
@@ -92,6 +170,10 @@ class Track:
         """
         self.mean, self.covariance = kf.update(self.mean, self.covariance,
                                                detection.to_xyah())
+        self.mark_hit(detection)
+
+    def mark_hit(self, detection):
+        """Record the associated detection, after the state is updated with it."""
         self.keypoints_list.append(detection.keypoints)
 
         self.hist += 1
@@ -118,12 +200,14 @@ class Track:
 
 
 class Tracker:
-    def __init__(self, max_iou_distance=0.7, max_age=30, n_init=5):
+    def __init__(self, max_iou_distance=0.7, max_age=30, n_init=5, solver=linear_assignment):
         self.max_iou_dist = max_iou_distance
         self.max_age = max_age
         self.n_init = n_init
+        self.solver = solver
 
         self.kf = KalmanFilter()
+        self.states = KalmanStates()
         self.tracks = []
         self._next_id = 1
 
@@ -131,8 +215,13 @@ class Tracker:
         """Propagate track state distributions one time step forward.
         This function should be called once every time step, before `update`.
         """
+        if len(self.tracks) == 0:
+            return
+        slots = [track.slot for track in self.tracks]
+        self.states.mean[slots], self.states.covariance[slots] = self.kf.predict_batch(
+            self.states.mean[slots], self.states.covariance[slots])
         for track in self.tracks:
-            track.predict(self.kf)
+            track.mark_predicted()
 
     def update(self, detections):
         """Perform measurement update and track management.
@@ -145,8 +234,13 @@ class Tracker:
         matches, unmatched_tracks, unmatched_detections = self._match(detections)
 
         # Update matched tracks set.
+        if len(matches):
+            slots = [self.tracks[track_idx].slot for track_idx, _ in matches]
+            measurements = np.asarray([detections[detection_idx].to_xyah() for _, detection_idx in matches])
+            self.states.mean[slots], self.states.covariance[slots] = self.kf.update_batch(
+                self.states.mean[slots], self.states.covariance[slots], measurements)
         for track_idx, detection_idx in matches:
-            self.tracks[track_idx].update(self.kf, detections[detection_idx])
+            self.tracks[track_idx].mark_hit(detections[detection_idx])
         # Update tracks that missing.
         for track_idx in unmatched_tracks:
             self.tracks[track_idx].mark_missed()
@@ -155,6 +249,9 @@ class Tracker:
             self._initiate_track(detections[detection_idx])
 
         # Remove deleted tracks.
+        for t in self.tracks:
+            if t.is_deleted():
+                self.states.remove(t.slot)
         self.tracks = [t for t in self.tracks if not t.is_deleted()]
 
     def _match(self, detections):
@@ -165,8 +262,11 @@ class Tracker:
             else:
                 unconfirmed_tracks.append(i)
 
+        # Track boxes are fixed until the update, so one cost matrix serves every match below.
+        iou_cost = IouCost()
         matches_a, unmatched_tracks_a, unmatched_detections = matching_cascade(
-            iou_cost, self.max_iou_dist, self.max_age, self.tracks, detections, confirmed_tracks
+            iou_cost, self.max_iou_dist, self.max_age, self.tracks, detections, confirmed_tracks,
+            solver=self.solver
         )
 
         track_candidates = unconfirmed_tracks + [
@@ -175,7 +275,8 @@ class Tracker:
             k for k in unmatched_tracks_a if self.tracks[k].time_since_update != 1]
 
         matches_b, unmatched_tracks_b, unmatched_detections = min_cost_matching(
-            iou_cost, self.max_iou_dist, self.tracks, detections, track_candidates, unmatched_detections
+            iou_cost, self.max_iou_dist, self.tracks, detections, track_candidates, unmatched_detections,
+            solver=self.solver
         )
 
         matches = matches_a + matches_b
@@ -186,7 +287,8 @@ class Tracker:
         if detection.confidence < 0.4:
             return
         mean, covariance = self.kf.initiate(detection.to_xyah())
-        self.tracks.append(Track(mean, covariance, self._next_id, self.n_init, self.max_age))
+        self.tracks.append(Track(mean, covariance, self._next_id, self.n_init, self.max_age,
+                                 states=self.states))
         self._next_id += 1
 
 
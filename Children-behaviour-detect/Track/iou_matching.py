@@ -37,6 +37,31 @@ def iou(bbox, candidates):
     return area_intersection / (area_bbox + area_candidates - area_intersection)
 
 
+def iou_matrix(bboxes, candidates):
+    """Compute intersection over union of every box against every candidate.
+    Parameters
+    ----------
+    bboxes : ndarray
+        A matrix of N bounding boxes (one per row) in format
+        `(xmin, ymin, xmax, ymax)`.
+    candidates : ndarray
+        A matrix of M candidate bounding boxes in the same format.
+
+    Returns
+    -------
+    ndarray
+        The NxM intersection over union, where row i is `iou(bboxes[i], candidates)`.
+    """
+    tl = np.maximum(bboxes[:, np.newaxis, :2], candidates[np.newaxis, :, :2])
+    br = np.minimum(bboxes[:, np.newaxis, 2:], candidates[np.newaxis, :, 2:])
+    wh = np.maximum(0., br - tl)
+
+    area_intersection = wh.prod(axis=2)
+    area_bboxes = (bboxes[:, 2:] - bboxes[:, :2]).prod(axis=1)
+    area_candidates = (candidates[:, 2:] - candidates[:, :2]).prod(axis=1)
+    return area_intersection / (area_bboxes[:, np.newaxis] + area_candidates - area_intersection)
+
+
 def iou_cost(tracks, detections, track_indices=None, detection_indices=None):
     """An intersection over union distance metric.
     Parameters
@@ -65,14 +90,30 @@ def iou_cost(tracks, detections, track_indices=None, detection_indices=None):
     if detection_indices is None:
         detection_indices = np.arange(len(detections))
 
-    cost_matrix = np.zeros((len(track_indices), len(detection_indices)))
-    for row, track_idx in enumerate(track_indices):
-        #if tracks[track_idx].time_since_update > 1:
-        #    cost_matrix[row, :] = INFTY_COST
-        #    continue
+    if len(track_indices) == 0 or len(detection_indices) == 0:
+        return np.zeros((len(track_indices), len(detection_indices)))
+
+    bboxes = np.asarray([tracks[i].to_tlbr() for i in track_indices], dtype=np.float64)
+    candidates = np.asarray([detections[i].tlbr for i in detection_indices], dtype=np.float64)
+    return 1. - iou_matrix(bboxes, candidates)
+
+
+class IouCost:
+    """`iou_cost` of a single frame. The cost matrix of all tracks against all
+    detections is computed on the first call and every later call, such as each
+    level of the matching cascade, takes its rows and columns from it. Make a
+    new one for every frame.
+    """
+    def __init__(self):
+        self.cost_matrix = None
 
-        bbox = tracks[track_idx].to_tlbr()
-        candidates = np.asarray([detections[i].tlbr for i in detection_indices])
-        cost_matrix[row, :] = 1. - iou(bbox, candidates)
+    def __call__(self, tracks, detections, track_indices=None, detection_indices=None):
+        if self.cost_matrix is None:
+            self.cost_matrix = iou_cost(tracks, detections)
+        if track_indices is None:
+            track_indices = np.arange(len(tracks))
+        if detection_indices is None:
+            detection_indices = np.arange(len(detections))
 
-    return cost_matrix
+        return self.cost_matrix[np.ix_(np.asarray(track_indices, dtype=int),
+                                       np.asarray(detection_indices, dtype=int))]
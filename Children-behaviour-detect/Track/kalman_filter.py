@@ -97,6 +97,37 @@ class KalmanFilter(object):
 
         return mean, covariance
 
+    def predict_batch(self, mean, covariance):
+        """Run Kalman filter prediction step of many tracks at once.
+        Parameters
+        ----------
+        mean : ndarray
+            The Tx8 dimensional mean vectors of the object states at the
+            previous time step.
+        covariance : ndarray
+            The Tx8x8 dimensional covariance matrices of the object states at
+            the previous time step.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the mean vectors and covariance matrices of the predicted
+            states, as `predict` for every track.
+        """
+        h = mean[:, 3]
+        std = np.empty_like(mean)
+        std[:, [0, 1, 3]] = self._std_weight_position * h[:, np.newaxis]
+        std[:, 2] = 1e-2
+        std[:, [4, 5, 7]] = self._std_weight_velocity * h[:, np.newaxis]
+        std[:, 6] = 1e-5
+
+        mean = np.dot(mean, self._motion_mat.T)
+        covariance = self._motion_mat @ covariance @ self._motion_mat.T
+        diag = np.arange(mean.shape[1])
+        covariance[:, diag, diag] += np.square(std)
+
+        return mean, covariance
+
     def project(self, mean, covariance):
         """Project state distribution to measurement space.
         Parameters
@@ -156,6 +187,50 @@ class KalmanFilter(object):
             kalman_gain, projected_cov, kalman_gain.T))
         return new_mean, new_covariance
 
+    def project_batch(self, mean, covariance):
+        """Project the state distributions of many tracks to measurement space,
+        as `project` for every row of the Tx8 `mean` and Tx8x8 `covariance`.
+        """
+        h = mean[:, 3]
+        std = np.empty((len(mean), 4))
+        std[:, [0, 1, 3]] = self._std_weight_position * h[:, np.newaxis]
+        std[:, 2] = 1e-1
+
+        mean = np.dot(mean, self._update_mat.T)
+        covariance = self._update_mat @ covariance @ self._update_mat.T
+        diag = np.arange(4)
+        covariance[:, diag, diag] += np.square(std)
+        return mean, covariance
+
+    def update_batch(self, mean, covariance, measurement):
+        """Run Kalman filter correction step of many tracks at once.
+        Parameters
+        ----------
+        mean : ndarray
+            The Tx8 dimensional predicted mean vectors.
+        covariance : ndarray
+            The Tx8x8 dimensional covariance matrices.
+        measurement : ndarray
+            The Tx4 dimensional measurement vectors (x, y, a, h).
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the measurement-corrected state distributions, as `update`
+            for every track.
+        """
+        projected_mean, projected_cov = self.project_batch(mean, covariance)
+
+        # Projected covariances are symmetric, so K = P H^T S^-1 is solved as S K^T = H P.
+        kalman_gain = np.linalg.solve(
+            projected_cov, np.swapaxes(covariance @ self._update_mat.T, 1, 2))
+        kalman_gain = np.swapaxes(kalman_gain, 1, 2)
+        innovation = measurement - projected_mean
+
+        new_mean = mean + np.einsum('tij,tj->ti', kalman_gain, innovation)
+        new_covariance = covariance - kalman_gain @ projected_cov @ np.swapaxes(kalman_gain, 1, 2)
+        return new_mean, new_covariance
+
     def gating_distance(self, mean, covariance, measurements,
                         only_position=False):
         """Compute gating distance between state distribution and measurements.
@@ -196,3 +271,42 @@ class KalmanFilter(object):
             overwrite_b=True)
         squared_maha = np.sum(z * z, axis=0)
         return squared_maha
+
+
+class KalmanStates(object):
+    """Stacked state distributions of many tracks, so the Kalman filter steps of
+    all tracks run as one batched operation. Each track owns a slot, its mean and
+    covariance are rows of `mean` (Nx8) and `covariance` (Nx8x8).
+
+    Parameters
+    ----------
+    capacity : int
+        Number of slots to allocate at first, it grows when they are all used.
+    ndim : int
+        Dimension of the state space.
+    """
+    def __init__(self, capacity=32, ndim=8):
+        self.mean = np.zeros((capacity, ndim))
+        self.covariance = np.zeros((capacity, ndim, ndim))
+        self.used = np.zeros(capacity, dtype=bool)
+
+    def add(self, mean, covariance):
+        """Store a new state distribution and return its slot."""
+        free = np.flatnonzero(~self.used)
+        if len(free) == 0:
+            n = len(self.used)
+            grow = max(n, 1)
+            self.mean = np.concatenate((self.mean, np.zeros((grow,) + self.mean.shape[1:])))
+            self.covariance = np.concatenate(
+                (self.covariance, np.zeros((grow,) + self.covariance.shape[1:])))
+            self.used = np.concatenate((self.used, np.zeros(grow, dtype=bool)))
+            free = [n]
+        slot = int(free[0])
+        self.mean[slot] = mean
+        self.covariance[slot] = covariance
+        self.used[slot] = True
+        return slot
+
+    def remove(self, slot):
+        """Free the slot of a state distribution no longer tracked."""
+        self.used[slot] = False
@@ -1,6 +1,5 @@
 import numpy as np
-#from scipy.optimize import linear_sum_assignment as linear_assignment
-from sklearn.utils.linear_assignment_ import linear_assignment
+from scipy.optimize import linear_sum_assignment
 
 """
 Table for the 0.95 quantile of the chi-square distribution with N degrees of
@@ -18,10 +17,49 @@ chi2inv95 = {
     8: 15.507,
     9: 16.919}
 INFTY_COST = 1e+5
+# Below this size scipy is called directly, the greedy check would cost more than it saves.
+GREEDY_MIN_SIZE = 32
+
+
+def linear_assignment(cost_matrix):
+    """Solve the minimum cost assignment of rows to columns.
+    Parameters
+    ----------
+    cost_matrix : ndarray
+        The NxM dimensional cost matrix.
+
+    Returns
+    -------
+    ndarray
+        Returns a (min(N, M), 2) array of matched (row, col) indices.
+    """
+    n_rows, n_cols = cost_matrix.shape
+    if n_rows == 0 or n_cols == 0:
+        return np.empty((0, 2), dtype=int)
+    if n_rows == 1:
+        return np.array([[0, cost_matrix[0].argmin()]])
+    if n_cols == 1:
+        return np.array([[cost_matrix[:, 0].argmin(), 0]])
+    if min(n_rows, n_cols) < GREEDY_MIN_SIZE:
+        return np.array(linear_sum_assignment(cost_matrix)).T
+
+    # Greedy: when every row (or column) has its minimum in a different column
+    # (or row), taking those minimums is already the optimal assignment.
+    if n_rows <= n_cols:
+        cols = cost_matrix.argmin(axis=1)
+        if np.bincount(cols, minlength=n_cols).max() == 1:
+            return np.stack((np.arange(n_rows), cols), axis=1)
+    else:
+        rows = cost_matrix.argmin(axis=0)
+        if np.bincount(rows, minlength=n_rows).max() == 1:
+            order = rows.argsort()
+            return np.stack((rows[order], order), axis=1)
+
+    return np.array(linear_sum_assignment(cost_matrix)).T
 
 
 def min_cost_matching(distance_metric, max_distance, tracks, detections,
-                      track_indices=None, detection_indices=None):
+                      track_indices=None, detection_indices=None, solver=linear_assignment):
     """Solve linear assignment problem.
     Parameters
     ----------
@@ -44,6 +82,9 @@ def min_cost_matching(distance_metric, max_distance, tracks, detections,
     detection_indices : List[int]
         List of detection indices that maps columns in `cost_matrix` to
         detections in `detections` (see description above).
+    solver : Callable[ndarray) -> ndarray
+        Assignment solver returning the matched (row, col) pairs of a cost
+        matrix. Defaults to `linear_assignment`.
 
     Returns
     -------
@@ -63,16 +104,16 @@ def min_cost_matching(distance_metric, max_distance, tracks, detections,
 
     cost_matrix = distance_metric(tracks, detections, track_indices, detection_indices)
     cost_matrix[cost_matrix > max_distance] = max_distance + 1e-5
-    indices = linear_assignment(cost_matrix)
-    indices = np.array(indices)
+    indices = np.asarray(solver(cost_matrix), dtype=int).reshape(-1, 2)
 
-    matches, unmatched_tracks, unmatched_detections = [], [], []
-    for col, detection_idx in enumerate(detection_indices):
-        if col not in indices[:, 1]:
-            unmatched_detections.append(detection_idx)
-    for row, track_idx in enumerate(track_indices):
-        if row not in indices[:, 0]:
-            unmatched_tracks.append(track_idx)
+    matched_cols = np.zeros(len(detection_indices), dtype=bool)
+    matched_cols[indices[:, 1]] = True
+    matched_rows = np.zeros(len(track_indices), dtype=bool)
+    matched_rows[indices[:, 0]] = True
+
+    matches = []
+    unmatched_detections = [detection_indices[col] for col in np.flatnonzero(~matched_cols)]
+    unmatched_tracks = [track_indices[row] for row in np.flatnonzero(~matched_rows)]
     for row, col in indices:
         track_idx = track_indices[row]
         detection_idx = detection_indices[col]
@@ -86,7 +127,7 @@ def min_cost_matching(distance_metric, max_distance, tracks, detections,
 
 
 def matching_cascade(distance_metric, max_distance, cascade_depth, tracks, detections,
-                     track_indices=None, detection_indices=None):
+                     track_indices=None, detection_indices=None, solver=linear_assignment):
     """Run matching cascade.
     Parameters
     ----------
@@ -112,6 +153,8 @@ def matching_cascade(distance_metric, max_distance, cascade_depth, tracks, detec
         List of detection indices that maps columns in `cost_matrix` to
         detections in `detections` (see description above). Defaults to all
         detections.
+    solver : Callable[ndarray) -> ndarray
+        Assignment solver, see `min_cost_matching`.
 
     Returns
     -------
@@ -138,7 +181,8 @@ def matching_cascade(distance_metric, max_distance, cascade_depth, tracks, detec
             continue
 
         matches_l, _, unmatched_detections = min_cost_matching(
-            distance_metric, max_distance, tracks, detections, track_indices_l, unmatched_detections)
+            distance_metric, max_distance, tracks, detections, track_indices_l, unmatched_detections,
+            solver)
         matches += matches_l
 
     unmatched_tracks = list(set(track_indices) - set(k for k, _ in matches))
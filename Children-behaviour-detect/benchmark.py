@@ -0,0 +1,436 @@
+"""Micro-benchmarks of the pipeline stages.
+
+Usage:
+    python benchmark.py crop
+    python benchmark.py detect
+    python benchmark.py nms
+    python benchmark.py assign
+    python benchmark.py kalman
+    python benchmark.py pose_nms
+    python benchmark.py precision --clip <recorded video>
+"""
+import os
+import time
+import argparse
+import numpy as np
+import torch
+
+from SPPE.src.utils.img import im_to_torch, cropBox, crop_dets
+from DetectorLoader import TinyYOLOv3_onecls
+from ActionsEstLoader import TSSTG
+from precision import PRECISIONS
+from quantization import quantized_weight_file
+from Detection.Utils import xywh2xyxy, bbox_iou, non_max_suppression, merge_track_boxes, read_clip
+from scipy.optimize import linear_sum_assignment
+from Track.iou_matching import iou_matrix
+from Track.linear_assignment import linear_assignment
+from Track.kalman_filter import KalmanFilter
+from Track.Tracker import Detection, Tracker
+from pose_utils import kpt2bbox
+import pPose_nms
+from pPose_nms import pose_nms, poses_overlap, pose_nms_disjoint, get_parametric_distance, PCK_match, \
+    p_merge_fast
+
+
+def timeit(fn, repeat=20):
+    """Mean seconds per call of `fn` after one warm-up call."""
+    fn()
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat
+
+
+def random_boxes(n, img_w, img_h, rng):
+    x1 = rng.uniform(0, img_w * 0.8, n)
+    y1 = rng.uniform(0, img_h * 0.6, n)
+    x2 = np.minimum(x1 + rng.uniform(30, 150, n), img_w)
+    y2 = np.minimum(y1 + rng.uniform(60, 250, n), img_h)
+    return torch.tensor(np.stack([x1, y1, x2, y2], 1), dtype=torch.float32)
+
+
+def crop_dets_per_box(img, boxes, height, width):
+    """Previous `crop_dets`: one full-frame clone and `cropBox` per box."""
+    img = im_to_torch(img)
+    img_h = img.size(1)
+    img_w = img.size(2)
+    img[0].add_(-0.406)
+    img[1].add_(-0.457)
+    img[2].add_(-0.480)
+
+    inps = torch.zeros(len(boxes), 3, height, width)
+    pt1 = torch.zeros(len(boxes), 2)
+    pt2 = torch.zeros(len(boxes), 2)
+    for i, box in enumerate(boxes):
+        upLeft = torch.Tensor((float(box[0]), float(box[1])))
+        bottomRight = torch.Tensor((float(box[2]), float(box[3])))
+
+        h = bottomRight[1] - upLeft[1]
+        w = bottomRight[0] - upLeft[0]
+        scaleRate = 0.2 if w > 100 else 0.3
+
+        upLeft[0] = max(0, upLeft[0] - w * scaleRate / 2)
+        upLeft[1] = max(0, upLeft[1] - h * scaleRate / 2)
+        bottomRight[0] = max(min(img_w - 1, bottomRight[0] + w * scaleRate / 2), upLeft[0] + 5)
+        bottomRight[1] = max(min(img_h - 1, bottomRight[1] + h * scaleRate / 2), upLeft[1] + 5)
+
+        inps[i] = cropBox(img.clone(), upLeft, bottomRight, height, width)
+        pt1[i] = upLeft
+        pt2[i] = bottomRight
+
+    return inps, pt1, pt2
+
+
+def bench_crop(args):
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (args.size, args.size, 3), dtype=np.uint8)
+    ph, pw = map(int, args.pose_input_size.split('x'))
+
+    print('{:>6} {:>12} {:>12} {:>8} {:>10}'.format('boxes', 'per-box ms', 'batched ms', 'speedup', 'max diff'))
+    for n in (1, 5, 20):
+        boxes = random_boxes(n, args.size, args.size, rng)
+        old = crop_dets_per_box(img, boxes, ph, pw)
+        new = crop_dets(img, boxes, ph, pw)
+        diff = max((a - b).abs().max().item() for a, b in zip(old, new))
+
+        t_old = timeit(lambda: crop_dets_per_box(img, boxes, ph, pw), args.repeat)
+        t_new = timeit(lambda: crop_dets(img, boxes, ph, pw), args.repeat)
+        print('{:>6} {:>12.3f} {:>12.3f} {:>7.2f}x {:>10.2g}'.format(
+            n, t_old * 1000, t_new * 1000, t_old / t_new, diff))
+
+
+def bench_detect(args):
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model = TinyYOLOv3_onecls(args.size, args.yolo_config, args.yolo_weights, device='cpu')
+    rng = np.random.default_rng(0)
+
+    print('{:>6} {:>12} {:>10}'.format('batch', 'ms / batch', 'frames/s'))
+    for batch_size in (1, 4, 16):
+        frames = rng.integers(0, 256, (batch_size, args.size, args.size, 3), dtype=np.uint8)
+        t = timeit(lambda: model.detect_batch(frames, need_resize=False), args.repeat)
+        print('{:>6} {:>12.2f} {:>10.2f}'.format(batch_size, t * 1000, batch_size / t))
+
+
+def non_max_suppression_loop(prediction, conf_thres=0.5, nms_thres=0.4):
+    """Previous `non_max_suppression`: IoU of the top box against the rest on every pass."""
+    prediction[..., :4] = xywh2xyxy(prediction[..., :4])
+    output = [None for _ in range(len(prediction))]
+    for image_i, image_pred in enumerate(prediction):
+        image_pred = image_pred[image_pred[:, 4] >= conf_thres]
+        if not image_pred.size(0):
+            continue
+        score = image_pred[:, 4] * image_pred[:, 5:].max(1)[0]
+        image_pred = image_pred[(-score).argsort()]
+        class_confs, class_preds = image_pred[:, 5:].max(1, keepdim=True)
+        detections = torch.cat((image_pred[:, :5], class_confs.float(), class_preds.float()), 1)
+        keep_boxes = []
+        while detections.size(0):
+            large_overlap = bbox_iou(detections[0, :4].unsqueeze(0), detections[:, :4]) > nms_thres
+            label_match = detections[0, -1] == detections[:, -1]
+            invalid = large_overlap & label_match
+            weights = detections[invalid, 4:5]
+            detections[0, :4] = (weights * detections[invalid, :4]).sum(0) / weights.sum()
+            keep_boxes += [detections[0]]
+            detections = detections[~invalid]
+        if keep_boxes:
+            output[image_i] = torch.stack(keep_boxes)
+
+    return output
+
+
+def random_predictions(n, num_classes, img_size, rng):
+    """Raw YOLO-like output (1, n, 5 + num_classes) of clustered (cx, cy, w, h) boxes."""
+    centers = rng.uniform(0, img_size, (max(1, n // 8), 2))
+    cxy = centers[rng.integers(0, len(centers), n)] + rng.normal(0, 8, (n, 2))
+    wh = rng.uniform(20, 120, (n, 2))
+    conf = rng.uniform(0, 1, (n, 1 + num_classes))
+    pred = np.concatenate([cxy, wh, conf], 1)[None]
+    return torch.tensor(pred, dtype=torch.float32)
+
+
+def bench_nms(args):
+    rng = np.random.default_rng(0)
+
+    # Equivalence against the previous implementation.
+    worst = 0.
+    for trial in range(200):
+        pred = random_predictions(int(rng.integers(1, 300)), int(rng.integers(1, 3)), args.size, rng)
+        conf_thres = rng.uniform(0.05, 0.6)
+        old = non_max_suppression_loop(pred.clone(), conf_thres, 0.2)[0]
+        new = non_max_suppression(pred.clone(), conf_thres, 0.2)[0]
+        assert (old is None) == (new is None), 'Detected different images!'
+        if old is not None:
+            assert old.shape == new.shape, 'Kept {} boxes instead of {}!'.format(len(new), len(old))
+            worst = max(worst, (old - new).abs().max().item())
+    print('equivalent on 200 random sets, max diff {:.2g}'.format(worst))
+
+    print('{:>6} {:>12} {:>12} {:>8}'.format('boxes', 'loop ms', 'matrix ms', 'speedup'))
+    for n in (50, 200, 1000):
+        pred = random_predictions(n, 1, args.size, rng)
+        t_old = timeit(lambda: non_max_suppression_loop(pred.clone(), 0.05, 0.2), args.repeat)
+        t_new = timeit(lambda: non_max_suppression(pred.clone(), 0.05, 0.2), args.repeat)
+        print('{:>6} {:>12.3f} {:>12.3f} {:>7.2f}x'.format(n, t_old * 1000, t_new * 1000, t_old / t_new))
+
+
+def random_iou_cost(n_tracks, n_dets, img_size, rng):
+    """1 - IoU of predicted track boxes against slightly moved detections of the same people."""
+    tl = rng.uniform(0, img_size * 0.8, (max(n_tracks, n_dets), 2))
+    boxes = np.c_[tl, tl + rng.uniform(30, 120, tl.shape)]
+    moved = boxes + rng.normal(0, 6, boxes.shape)
+    return 1. - iou_matrix(boxes[:n_tracks], moved[rng.permutation(len(moved))[:n_dets]])
+
+
+def bench_assign(args):
+    rng = np.random.default_rng(0)
+
+    print('{:>7} {:>12} {:>12} {:>8}'.format('tracks', 'scipy us', 'solver us', 'speedup'))
+    for n in (5, 20, 50):
+        costs = [random_iou_cost(n, n + int(rng.integers(-2, 3)), args.size, rng) for _ in range(50)]
+        # As the tracker needs them: a (K, 2) array of the matched (row, col).
+        t_old = timeit(lambda: [np.array(linear_sum_assignment(c)).T for c in costs], args.repeat) / len(costs)
+        t_new = timeit(lambda: [linear_assignment(c) for c in costs], args.repeat) / len(costs)
+        print('{:>7} {:>12.1f} {:>12.1f} {:>7.2f}x'.format(n, t_old * 1e6, t_new * 1e6, t_old / t_new))
+
+
+def random_track_states(kf, n, img_size, rng):
+    """Initiated state distributions of `n` tracks and measurements one step later."""
+    xyah = np.c_[rng.uniform(0, img_size, (n, 2)), rng.uniform(0.3, 0.7, n), rng.uniform(60, 250, n)]
+    states = [kf.initiate(m) for m in xyah]
+    mean = np.stack([m for m, _ in states])
+    covariance = np.stack([c for _, c in states])
+    return mean, covariance, xyah + rng.normal(0, 2, xyah.shape)
+
+
+def kalman_step_per_track(kf, mean, covariance, measurements):
+    out = [kf.update(*kf.predict(m, c), z) for m, c, z in zip(mean, covariance, measurements)]
+    return np.stack([m for m, _ in out]), np.stack([c for _, c in out])
+
+
+def kalman_step_batch(kf, mean, covariance, measurements):
+    return kf.update_batch(*kf.predict_batch(mean, covariance), measurements)
+
+
+def bench_kalman(args):
+    kf = KalmanFilter()
+    rng = np.random.default_rng(0)
+
+    mean, covariance, measurements = random_track_states(kf, 200, args.size, rng)
+    old = kalman_step_per_track(kf, mean, covariance, measurements)
+    new = kalman_step_batch(kf, mean, covariance, measurements)
+    print('equivalent on 200 tracks, max diff mean {:.2g} covariance {:.2g}'.format(
+        np.abs(old[0] - new[0]).max(), np.abs(old[1] - new[1]).max()))
+
+    print('{:>7} {:>12} {:>12} {:>8}'.format('tracks', 'per-track us', 'batched us', 'speedup'))
+    for n in (5, 20, 100):
+        mean, covariance, measurements = random_track_states(kf, n, args.size, rng)
+        t_old = timeit(lambda: kalman_step_per_track(kf, mean, covariance, measurements), args.repeat)
+        t_new = timeit(lambda: kalman_step_batch(kf, mean, covariance, measurements), args.repeat)
+        print('{:>7} {:>12.1f} {:>12.1f} {:>7.2f}x'.format(n, t_old * 1e6, t_new * 1e6, t_old / t_new))
+
+
+def pose_nms_loop(bboxes, bbox_scores, pose_preds, pose_scores):
+    """Previous `pose_nms`: one parametric distance and np.delete per pick, one merge per kept pose."""
+    pose_scores[pose_scores == 0] = 1e-5
+    ori_pose_preds = pose_preds.clone()
+    ori_pose_scores = pose_scores.clone()
+    ref_dists = pPose_nms.alpha * torch.max(bboxes[:, 2] - bboxes[:, 0], bboxes[:, 3] - bboxes[:, 1])
+
+    human_scores = pose_scores.mean(dim=1)
+    human_ids = np.arange(bboxes.shape[0])
+    pick = []
+    merge_ids = []
+    while human_scores.shape[0] != 0:
+        pick_id = torch.argmax(human_scores)
+        pick.append(human_ids[pick_id])
+        ref_dist = ref_dists[human_ids[pick_id]]
+        simi = get_parametric_distance(pick_id, pose_preds, pose_scores, ref_dist)
+        num_match_keypoints = PCK_match(pose_preds[pick_id], pose_preds, ref_dist)
+        delete_ids = torch.from_numpy(np.arange(human_scores.shape[0]))[
+            (simi > pPose_nms.gamma) | (num_match_keypoints >= pPose_nms.matchThreds)]
+        if delete_ids.shape[0] == 0:
+            delete_ids = pick_id
+        merge_ids.append(human_ids[delete_ids])
+        pose_preds = np.delete(pose_preds, delete_ids, axis=0)
+        pose_scores = np.delete(pose_scores, delete_ids, axis=0)
+        human_ids = np.delete(human_ids, delete_ids)
+        human_scores = np.delete(human_scores, delete_ids, axis=0)
+
+    final_result = []
+    for j in range(len(pick)):
+        if torch.max(ori_pose_scores[pick[j]]) < pPose_nms.scoreThreds:
+            continue
+        merge_pose, merge_score = p_merge_fast(
+            ori_pose_preds[pick[j]], ori_pose_preds[merge_ids[j]], ori_pose_scores[merge_ids[j]], ref_dists[pick[j]])
+        if torch.max(merge_score) < pPose_nms.scoreThreds:
+            continue
+        final_result.append({
+            'bbox': bboxes[pick[j]],
+            'bbox_score': bbox_scores[pick[j]],
+            'keypoints': merge_pose - 0.3,
+            'kp_score': merge_score,
+            'proposal_score': torch.mean(merge_score) + bbox_scores[pick[j]] + 1.25 * max(merge_score)
+        })
+    return final_result
+
+
+def random_pose_candidates(n_people, img_size, rng, dup=(1, 4)):
+    """Boxes, box scores, (n, 13, 2) poses and (n, 13, 1) scores of `n_people`,
+    each found by a random number of slightly different boxes.
+    """
+    boxes, preds, scores = [], [], []
+    for _ in range(n_people):
+        tl = rng.uniform(0, img_size * 0.8, 2)
+        wh = rng.uniform(30, 150, 2)
+        pose = tl + rng.uniform(0, 1, (13, 2)) * wh
+        for _ in range(rng.integers(*dup)):
+            shift = rng.normal(0, 3, 2)
+            boxes.append(np.r_[tl + shift, tl + shift + wh])
+            preds.append(pose + rng.normal(0, 2, (13, 2)))
+            scores.append(rng.uniform(0, 1, (13, 1)))
+    n = len(boxes)
+    return (torch.tensor(np.array(boxes).reshape(n, 4), dtype=torch.float32),
+            torch.tensor(rng.uniform(0, 1, n), dtype=torch.float32),
+            torch.tensor(np.array(preds).reshape(n, 13, 2), dtype=torch.float32),
+            torch.tensor(np.array(scores).reshape(n, 13, 1), dtype=torch.float32))
+
+
+def bench_pose_nms(args):
+    rng = np.random.default_rng(0)
+
+    # Equivalence against the previous implementation.
+    worst = 0.
+    for trial in range(500):
+        inputs = random_pose_candidates(int(rng.integers(0, 8)), args.size, rng)
+        old = pose_nms_loop(*[x.clone() for x in inputs])
+        new = pose_nms(*[x.clone() for x in inputs])
+        assert len(old) == len(new), 'Kept {} poses instead of {}!'.format(len(new), len(old))
+        for a, b in zip(old, new):
+            worst = max(worst, max((a[k] - b[k]).abs().max().item() for k in a))
+    print('equivalent on 500 random sets, max diff {:.2g}'.format(worst))
+
+    print('{:>7} {:>6} {:>12} {:>12} {:>8}'.format('people', 'boxes', 'loop ms', 'matrix ms', 'speedup'))
+    for n in (1, 3, 10, 30):
+        inputs = random_pose_candidates(n, args.size, rng)
+        t_old = timeit(lambda: pose_nms_loop(*[x.clone() for x in inputs]), args.repeat)
+        t_new = timeit(lambda: pose_nms(*inputs), args.repeat)
+        print('{:>7} {:>6} {:>12.3f} {:>12.3f} {:>7.2f}x'.format(
+            n, len(inputs[0]), t_old * 1000, t_new * 1000, t_old / t_new))
+
+    # Fast path of well separated people, one box each.
+    print('{:>7} {:>6} {:>12} {:>12} {:>8}'.format('people', 'fast', 'matrix ms', 'fast ms', 'speedup'))
+    for n in (1, 3):
+        inputs = random_pose_candidates(n, args.size * 4, rng, dup=(1, 2))
+        t_old = timeit(lambda: pose_nms(*inputs), args.repeat)
+        t_new = timeit(lambda: poses_overlap(inputs[2]) or pose_nms_disjoint(*inputs), args.repeat)
+        print('{:>7} {:>6} {:>12.3f} {:>12.3f} {:>7.2f}x'.format(
+            n, str(not poses_overlap(inputs[2])), t_old * 1000, t_new * 1000, t_old / t_new))
+
+
+def bench_precision(args):
+    from PoseEstimateLoader import SPPE_FastPose
+
+    assert args.clip, 'Give a recorded clip with --clip!'
+    frames = read_clip(args.clip, args.size, args.frames)
+    assert len(frames), 'Can not read {}!'.format(args.clip)
+    ph, pw = map(int, args.pose_input_size.split('x'))
+
+    def load(precision):
+        if precision == 'int8':
+            return (TinyYOLOv3_onecls(args.size, args.yolo_config, args.yolo_weights, device='cpu'),
+                    SPPE_FastPose('resnet50', ph, pw, device='cpu', quantized=True),
+                    TSSTG(quantized=True))
+        return (TinyYOLOv3_onecls(args.size, args.yolo_config, args.yolo_weights, device='cpu', precision=precision),
+                SPPE_FastPose('resnet50', ph, pw, device='cpu', precision=precision),
+                TSSTG(precision=precision))
+
+    # INT8 pose and action models, once saved by quantization.py.
+    modes = list(PRECISIONS)
+    if all(os.path.isfile(quantized_weight_file(f)) for f in
+           ('./Models/sppe/fast_res50_256x192.pth', './Models/TSSTG/tsstg-model.pth')):
+        modes.append('int8')
+
+    # fp32 run of the pipeline, its boxes and track windows are the inputs of every precision,
+    # so each model is only compared on its own drift.
+    detect_model, pose_model, action_model = load('fp32')
+    tracker = Tracker(max_age=30, n_init=3)
+    inputs = []
+    for frame in frames:
+        detected = detect_model.detect(frame, need_resize=False, expand_bb=10)
+        tracker.predict()
+        detected = merge_track_boxes(detected, [track.to_tlbr() for track in tracker.tracks], object_conf=0.5)
+        poses = pose_model.predict(frame, detected[:, 0:4], detected[:, 4]) if detected is not None else []
+        tracker.update([Detection(kpt2bbox(ps['keypoints'].numpy()),
+                                  np.concatenate((ps['keypoints'].numpy(), ps['kp_score'].numpy()), axis=1),
+                                  ps['kp_score'].mean().numpy()) for ps in poses])
+        windows = [track.keypoints_list.window().copy() for track in tracker.tracks
+                   if track.is_confirmed() and len(track.keypoints_list) == 30]
+        inputs.append((frame, detected, windows))
+
+    reference = None
+    print('{} frames, {} action windows'.format(len(frames), sum(len(w) for _, _, w in inputs)))
+    print('{:>18} {:>10} {:>10} {:>10} {:>9} {:>9} {:>9} {:>9}'.format(
+        'precision', 'detect ms', 'pose ms', 'action ms', 'kpt px', 'pose agr', 'act agr', 'act diff'))
+    for precision in modes:
+        detect_model, pose_model, action_model = load(precision)
+        t_detect = t_pose = t_action = 0.
+        results = []
+        for frame, detected, windows in inputs:
+            t0 = time.perf_counter()
+            detect_model.detect(frame, need_resize=False, expand_bb=10)
+            t1 = time.perf_counter()
+            poses = pose_model.predict(frame, detected[:, 0:4], detected[:, 4]) if detected is not None else []
+            t2 = time.perf_counter()
+            actions = action_model.predict_batch(windows, frame.shape[:2])
+            t3 = time.perf_counter()
+            t_detect, t_pose, t_action = t_detect + t1 - t0, t_pose + t2 - t1, t_action + t3 - t2
+            results.append(({tuple(ps['bbox'].tolist()): ps['keypoints'] for ps in poses}, actions))
+        if reference is None:
+            reference = results
+
+        # Poses picked from the same box, and their keypoints error, against fp32.
+        kpt_err, matched, total = [], 0, 0
+        for (poses, _), (ref_poses, _) in zip(results, reference):
+            total += max(len(poses), len(ref_poses))
+            for box, keypoints in poses.items():
+                if box in ref_poses:
+                    matched += 1
+                    kpt_err.append((keypoints - ref_poses[box]).norm(dim=1).mean().item())
+        actions = np.concatenate([a for _, a in results])
+        ref_actions = np.concatenate([a for _, a in reference])
+        n = len(frames)
+        print('{:>18} {:>10.2f} {:>10.2f} {:>10.2f} {:>9.3f} {:>8.1f}% {:>8.1f}% {:>9.2g}'.format(
+            precision, t_detect / n * 1000, t_pose / n * 1000, t_action / n * 1000,
+            np.mean(kpt_err) if kpt_err else 0., matched / total * 100 if total else 100.,
+            (actions.argmax(1) == ref_actions.argmax(1)).mean() * 100 if len(actions) else 100.,
+            np.abs(actions - ref_actions).max() if len(actions) else 0.))
+
+
+BENCHMARKS = {
+    'crop': bench_crop,
+    'detect': bench_detect,
+    'nms': bench_nms,
+    'assign': bench_assign,
+    'kalman': bench_kalman,
+    'pose_nms': bench_pose_nms,
+    'precision': bench_precision,
+}
+
+
+if __name__ == '__main__':
+    par = argparse.ArgumentParser(description='Pipeline micro-benchmarks.')
+    par.add_argument('name', choices=sorted(BENCHMARKS), help='Benchmark to run.')
+    par.add_argument('--size', type=int, default=384, help='Frame size (square) in pixels.')
+    par.add_argument('--pose_input_size', type=str, default='224x160',
+                     help='Input size (HxW) for pose model.')
+    par.add_argument('--repeat', type=int, default=20, help='Timed calls per measurement.')
+    par.add_argument('--threads', type=int, default=0, help='Torch CPU threads, 0 for default.')
+    par.add_argument('--yolo_config', type=str, default='Models/yolo-tiny-onecls/yolov3-tiny-onecls.cfg',
+                     help='Tiny-YOLOv3 config file.')
+    par.add_argument('--yolo_weights', type=str, default='Models/yolo-tiny-onecls/best-model.pth',
+                     help='Tiny-YOLOv3 weights file.')
+    par.add_argument('--clip', type=str, default='', help='Recorded video for the precision drift report.')
+    par.add_argument('--frames', type=int, default=150, help='Frames of the clip to use.')
+    args = par.parse_args()
+
+    BENCHMARKS[args.name](args)
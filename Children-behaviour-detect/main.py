@@ -7,17 +7,19 @@ os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
 import cv2
 import time
-import torch
 import argparse
 import numpy as np
 
-from Detection.Utils import ResizePadding
+from Detection.Utils import ResizePadding, merge_track_boxes
 from CameraLoader import CamLoader, CamLoader_Q
 from DetectorLoader import TinyYOLOv3_onecls
 from PoseEstimateLoader import SPPE_FastPose
 from fn import draw_single
 from Track.Tracker import Detection, Tracker
-from ActionsEstLoader import TSSTG
+from ActionsEstLoader import TSSTG, ActionScheduler
+from precision import PRECISIONS
+from pipeline import Pipeline, Stage
+from pose_utils import kpt2bbox
 
 
 # ----------------------------
@@ -29,16 +31,6 @@ def preproc(image):
     return image
 
 
-# ----------------------------
-# Convert keypoints to bbox
-# ----------------------------
-def kpt2bbox(kpt, ex=20):
-    return np.array((
-        kpt[:, 0].min() - ex, kpt[:, 1].min() - ex,
-        kpt[:, 0].max() + ex, kpt[:, 1].max() + ex
-    ))
-
-
 # ----------------------------
 # Main
 # ----------------------------
@@ -56,6 +48,22 @@ if __name__ == '__main__':
     par.add_argument('--save_out', type=str, default='',
                      help='If ends with .mp4/.avi => save video; otherwise treated as a folder to save images.')
     par.add_argument('--device', type=str, default='cpu', help='Device: cpu or cuda.')
+    par.add_argument('--precision', type=str, default='fp32', choices=PRECISIONS,
+                     help='Inference precision / memory format of the three models, '
+                          'see `python benchmark.py precision` for their speed and drift.')
+    par.add_argument('--int8', default=False, action='store_true',
+                     help='Use the INT8 pose and action models saved by quantization.py (cpu only).')
+    par.add_argument('--queue_policy', type=str, default='block', choices=CamLoader_Q.policies,
+                     help='What to do with decoded frames of a video file when the queue is full.')
+    par.add_argument('--action_stride', type=int, default=4,
+                     help='Run the action model of each track every N frames, 1 for every frame.')
+    par.add_argument('--action_motion', type=float, default=0.15,
+                     help='Keypoints motion (relative to person height) that runs the action model at once, '
+                          '0 to disable.')
+    par.add_argument('--detect_workers', type=int, default=1,
+                     help='Threads running the detector, each on its own frame.')
+    par.add_argument('--pipeline_queue', type=int, default=2,
+                     help='Frames waiting between two steps of the pipeline.')
     args = par.parse_args()
 
     device = args.device
@@ -66,13 +74,16 @@ if __name__ == '__main__':
     # Models
     # ----------------------------
     inp_dets = args.detection_input_size
-    detect_model = TinyYOLOv3_onecls(inp_dets, device=device)
+    detect_model = TinyYOLOv3_onecls(inp_dets, device=device, precision=args.precision)
 
     ph, pw = map(int, args.pose_input_size.split('x'))
-    pose_model = SPPE_FastPose(args.pose_backbone, ph, pw, device=device)
+    pose_model = SPPE_FastPose(args.pose_backbone, ph, pw, device=device, precision=args.precision,
+                               quantized=args.int8)
 
     tracker = Tracker(max_age=30, n_init=3)
-    action_model = TSSTG()
+    action_model = TSSTG(precision=args.precision, quantized=args.int8)
+    action_scheduler = ActionScheduler(action_model, stride=args.action_stride,
+                                       motion_thres=args.action_motion if args.action_motion > 0 else None)
     resize_fn = ResizePadding(inp_dets, inp_dets)
 
     # ----------------------------
@@ -80,10 +91,11 @@ if __name__ == '__main__':
     # ----------------------------
     cam_source = args.camera
     if isinstance(cam_source, str) and os.path.isfile(cam_source):
-        cam = CamLoader_Q(cam_source, queue_size=1000, preprocess=preproc).start()
+        cam = CamLoader_Q(cam_source, queue_size=1000, preprocess=preproc,
+                          policy=args.queue_policy).start()
     else:
         cam = CamLoader(int(cam_source) if str(cam_source).isdigit() else cam_source,
-                        preprocess=preproc).start()
+                        preprocess=preproc, ring_size=3).start()
 
     # ----------------------------
     # Output Config (Video OR Images)
@@ -116,6 +128,90 @@ if __name__ == '__main__':
     else:
         print("[OUT] 未指定 --save_out：不保存视频也不保存图片。")
 
+    # ----------------------------
+    # Pipeline
+    # ----------------------------
+    # 读帧 -> 检测 -> 跟踪+姿态+动作 -> 绘制 各自一个线程，用有界队列相连，按帧序号输出
+    def read_frame():
+        if not cam.grabbed():
+            return None
+        frame = cam.getitem()
+        return None if frame is None else frame.copy()
+
+    def detect(work_rgb):
+        detected = detect_model.detect(work_rgb, need_resize=False, expand_bb=10)
+        return work_rgb, detected
+
+    def track_step(item):
+        work_rgb, detected = item
+        tracker.predict()
+
+        # 将 YOLO 漏检的跟踪目标加入候选，增强稳健性（与检测框重叠的不再重复做姿态估计）
+        candidates = merge_track_boxes(detected, [track.to_tlbr() for track in tracker.tracks],
+                                       object_conf=0.5)
+
+        detections = []
+        if candidates is not None:
+            poses = pose_model.predict(work_rgb, candidates[:, 0:4], candidates[:, 4])
+
+            detections = [Detection(kpt2bbox(ps['keypoints'].numpy()),
+                                    np.concatenate((ps['keypoints'].numpy(),
+                                                    ps['kp_score'].numpy()), axis=1),
+                                    ps['kp_score'].mean().numpy()) for ps in poses]
+
+        tracker.update(detections)
+
+        # ------------------ Action Recognition ------------------
+        # 满 30 帧的已确认轨迹每 action_stride 帧跑一次 ST-GCN（动作快时立即跑），合并成一个 batch
+        action_scheduler.update(tracker.tracks, work_rgb.shape[:2])
+
+        # 只把绘制需要的内容拷贝给下一级，跟踪器在此期间继续处理下一帧
+        shown = []
+        for track in tracker.tracks:
+            if not track.is_confirmed() or track.time_since_update > 0:
+                continue
+
+            action = 'pending..'
+            clr = (0, 255, 0)
+            if len(track.keypoints_list) == 30:
+                out = track.actions
+                action_name = action_model.class_names[out[0].argmax()]
+                action = f'{action_name}: {out[0].max() * 100:.2f}%'
+                if action_name == 'Fall Down':
+                    clr = (255, 0, 0)
+                elif action_name == 'Lying Down':
+                    clr = (255, 200, 0)
+
+            shown.append((track.track_id, track.to_tlbr().astype(int), track.get_center().astype(int),
+                           track.keypoints_list[-1].copy(), action, clr))
+        return work_rgb, detected, shown
+
+    def draw(item):
+        work_rgb, detected, shown = item
+        if args.show_detected and detected is not None:
+            for bb in detected[:, 0:5]:
+                x1, y1, x2, y2 = map(int, bb[:4])
+                work_rgb = cv2.rectangle(work_rgb, (x1, y1), (x2, y2), (255, 0, 0), 1)
+
+        # 可视化（在 RGB 上画）
+        if args.show_skeleton:
+            for track_id, bbox, center, keypoints, action, clr in shown:
+                work_rgb = draw_single(work_rgb, keypoints)
+                x1, y1, x2, y2 = bbox.tolist()
+                work_rgb = cv2.rectangle(work_rgb, (x1, y1), (x2, y2), (0, 255, 0), 1)
+                work_rgb = cv2.putText(work_rgb, str(track_id), (int(center[0]), int(center[1])),
+                                       cv2.FONT_HERSHEY_COMPLEX, 0.4, (0, 0, 255), 2)
+                work_rgb = cv2.putText(work_rgb, action, (x1 + 5, y1 + 15),
+                                       cv2.FONT_HERSHEY_COMPLEX, 0.4, clr, 1)
+
+        # 转 BGR（cv2 期望 BGR），并做同一份缩放用于显示/保存，避免尺寸不一致
+        frame_bgr = work_rgb[:, :, ::-1]
+        return cv2.resize(frame_bgr, (0, 0), fx=2.0, fy=2.0)
+
+    pipeline = Pipeline(read_frame, [Stage(detect, workers=args.detect_workers),
+                                     Stage(track_step),
+                                     Stage(draw)], queue_size=args.pipeline_queue)
+
     # ----------------------------
     # Main Loop
     # ----------------------------
@@ -123,74 +219,11 @@ if __name__ == '__main__':
     f = 0
 
     try:
-        while cam.grabbed():
-            f += 1
-            frame = cam.getitem()
-            if frame is None:
-                break
-            work_rgb = frame.copy()
-
-            # ------------------ Detection ------------------
-            detected = detect_model.detect(work_rgb, need_resize=False, expand_bb=10)
-            tracker.predict()
-
-            # 将现有跟踪目标加入候选，增强稳健性
-            for track in tracker.tracks:
-                det = torch.tensor([track.to_tlbr().tolist() + [0.5, 1.0, 0.0]], dtype=torch.float32)
-                detected = torch.cat([detected, det], dim=0) if detected is not None else det
-
-            detections = []
-            if detected is not None:
-                poses = pose_model.predict(work_rgb, detected[:, 0:4], detected[:, 4])
-
-                detections = [Detection(kpt2bbox(ps['keypoints'].numpy()),
-                                        np.concatenate((ps['keypoints'].numpy(),
-                                                        ps['kp_score'].numpy()), axis=1),
-                                        ps['kp_score'].mean().numpy()) for ps in poses]
-
-                if args.show_detected:
-                    for bb in detected[:, 0:5]:
-                        x1, y1, x2, y2 = map(int, bb[:4])
-                        work_rgb = cv2.rectangle(work_rgb, (x1, y1), (x2, y2), (255, 0, 0), 1)
-
-            tracker.update(detections)
-
-            # ------------------ Action Recognition & Draw ------------------
-            for track in tracker.tracks:
-                if not track.is_confirmed():
-                    continue
-
-                track_id = track.track_id
-                bbox = track.to_tlbr().astype(int)
-                center = track.get_center().astype(int)
-
-                action = 'pending..'
-                clr = (0, 255, 0)
-                if len(track.keypoints_list) == 30:
-                    pts = np.array(track.keypoints_list, dtype=np.float32)
-                    out = action_model.predict(pts, work_rgb.shape[:2])
-                    action_name = action_model.class_names[out[0].argmax()]
-                    action = f'{action_name}: {out[0].max() * 100:.2f}%'
-                    if action_name == 'Fall Down':
-                        clr = (255, 0, 0)
-                    elif action_name == 'Lying Down':
-                        clr = (255, 200, 0)
-
-                # 可视化（在 RGB 上画）
-                if track.time_since_update == 0 and args.show_skeleton:
-                    work_rgb = draw_single(work_rgb, track.keypoints_list[-1])
-                    x1, y1, x2, y2 = bbox.tolist()
-                    work_rgb = cv2.rectangle(work_rgb, (x1, y1), (x2, y2), (0, 255, 0), 1)
-                    work_rgb = cv2.putText(work_rgb, str(track_id), (int(center[0]), int(center[1])),
-                                           cv2.FONT_HERSHEY_COMPLEX, 0.4, (0, 0, 255), 2)
-                    work_rgb = cv2.putText(work_rgb, action, (x1 + 5, y1 + 15),
-                                           cv2.FONT_HERSHEY_COMPLEX, 0.4, clr, 1)
+        pipeline.start()
+        for seq, frame_bgr in pipeline:
+            f = seq + 1
 
             # ------------------ Display & Save ------------------
-            # 转 BGR（cv2 期望 BGR），并做同一份缩放用于显示/保存，避免尺寸不一致
-            frame_bgr = work_rgb[:, :, ::-1]
-            frame_bgr = cv2.resize(frame_bgr, (0, 0), fx=2.0, fy=2.0)
-
             # FPS 文字（写在缩放后的帧上）
             now = time.time()
             fps = 1.0 / max(1e-6, (now - fps_time))
@@ -227,7 +260,11 @@ if __name__ == '__main__':
                 break
 
     finally:
+        pipeline.stop()
         cam.stop()
+        print(f"[CAM] 跳过(未处理)帧数: {cam.frames_dropped}")
+        print(f"[POSE] 无重叠跳过 pose NMS 次数: {pose_model.nms_skipped}/{pose_model.nms_calls}")
+        print(f"[ACT] 动作模型运行次数: {action_scheduler.runs}（其中动作触发: {action_scheduler.forced}）")
         if writer is not None:
             writer.release()
             print(f"[DONE] 视频已保存：{out_path}")
@@ -0,0 +1,237 @@
+"""Run the fall detection on several cameras or video files at once.
+
+Every source runs in its own process, with its own camera loader, models and
+tracker, so the streams do not share the GIL nor the torch threads. The
+workers send the persons and actions of every frame to this parent process
+over a queue, which prints a per-camera report and the fall alerts.
+
+Usage:
+    python multi_camera.py -C 0 1 rtsp://... room3.mp4
+"""
+import os
+os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
+
+import time
+import argparse
+import traceback
+import numpy as np
+import multiprocessing as mp
+
+from queue import Empty
+
+from precision import PRECISIONS
+from pose_utils import kpt2bbox
+
+FRAME = 'frame'
+DONE = 'done'
+
+
+def open_camera(source, preprocess):
+    from CameraLoader import CamLoader, CamLoader_Q
+    if os.path.isfile(source):
+        return CamLoader_Q(source, queue_size=64, preprocess=preprocess).start()
+    return CamLoader(int(source) if source.isdigit() else source, preprocess=preprocess, ring_size=3).start()
+
+
+def run_camera(index, source, args, results):
+    """Worker process of one source, puts `(FRAME, index, frame, fps, persons)` on
+    `results` for every frame and `(DONE, index, frames, seconds, error)` at the end.
+    """
+    frames, error = 0, None
+    cam = None
+    start = time.time()
+    try:
+        import cv2
+        import torch
+        from Detection.Utils import ResizePadding, merge_track_boxes
+        from DetectorLoader import TinyYOLOv3_onecls
+        from PoseEstimateLoader import SPPE_FastPose
+        from Track.Tracker import Detection, Tracker
+        from ActionsEstLoader import TSSTG, ActionScheduler
+
+        torch.set_num_threads(args.threads)
+
+        inp_dets = args.detection_input_size
+        detect_model = TinyYOLOv3_onecls(inp_dets, device=args.device, precision=args.precision)
+        ph, pw = map(int, args.pose_input_size.split('x'))
+        pose_model = SPPE_FastPose(args.pose_backbone, ph, pw, device=args.device, precision=args.precision,
+                                   quantized=args.int8)
+        action_model = TSSTG(precision=args.precision, quantized=args.int8)
+        action_scheduler = ActionScheduler(action_model, stride=args.action_stride)
+        tracker = Tracker(max_age=30, n_init=3)
+        resize_fn = ResizePadding(inp_dets, inp_dets)
+
+        cam = open_camera(source, lambda image: cv2.cvtColor(resize_fn(image), cv2.COLOR_BGR2RGB))
+        fps_time = time.time()
+        while cam.grabbed():
+            frame = cam.getitem()
+            if frame is None:
+                break
+            frames += 1
+
+            detected = detect_model.detect(frame, need_resize=False, expand_bb=10)
+            tracker.predict()
+            detected = merge_track_boxes(detected, [track.to_tlbr() for track in tracker.tracks],
+                                         object_conf=0.5)
+            detections = []
+            if detected is not None:
+                poses = pose_model.predict(frame, detected[:, 0:4], detected[:, 4])
+                detections = [Detection(kpt2bbox(ps['keypoints'].numpy()),
+                                        np.concatenate((ps['keypoints'].numpy(),
+                                                        ps['kp_score'].numpy()), axis=1),
+                                        ps['kp_score'].mean().numpy()) for ps in poses]
+            tracker.update(detections)
+            action_scheduler.update(tracker.tracks, frame.shape[:2])
+
+            # (track_id, tlbr, action, score) of the confirmed tracks, action is None until 30 frames.
+            persons = []
+            for track in tracker.tracks:
+                if not track.is_confirmed():
+                    continue
+                action, score = None, 0.
+                if track.actions is not None:
+                    action = action_model.class_names[track.actions[0].argmax()]
+                    score = float(track.actions[0].max())
+                persons.append((track.track_id, track.to_tlbr().tolist(), action, score))
+
+            now = time.time()
+            fps = 1.0 / max(1e-6, now - fps_time)
+            fps_time = now
+            results.put((FRAME, index, frames, fps, persons))
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        if cam is not None:
+            cam.stop()
+        results.put((DONE, index, frames, time.time() - start, error))
+
+
+class CameraReport(object):
+    """Latest state of one camera in the parent process.
+    Args:
+        source: (str) Camera or video file of the stream.
+        fps_window: (int) Frames to average the fps over.
+    """
+    def __init__(self, source, fps_window=30):
+        self.source = source
+        self.fps_window = fps_window
+        self.frames = 0
+        self.fps = []
+        self.persons = []
+        self.falls = 0
+        # track_id -> action on the previous frame, to alert once per fall.
+        self.last_actions = {}
+        # Run time sent by the worker, the parent's wall clock if it never came.
+        self.start = time.time()
+        self.seconds = None
+        self.done = False
+        self.error = None
+
+    def add(self, frame, fps, persons):
+        """Update with a frame of the worker, returns the (track_id, score) that just fell."""
+        self.frames = frame
+        self.fps = (self.fps + [fps])[-self.fps_window:]
+        self.persons = persons
+
+        fallen = [(track_id, score) for track_id, _, action, score in persons
+                  if action == 'Fall Down' and self.last_actions.get(track_id) != 'Fall Down']
+        self.falls += len(fallen)
+        self.last_actions = {track_id: action for track_id, _, action, _ in persons}
+        return fallen
+
+    def mean_fps(self):
+        return float(np.mean(self.fps)) if len(self.fps) else 0.
+
+    def total_fps(self):
+        seconds = self.seconds if self.seconds is not None else time.time() - self.start
+        return self.frames / seconds if seconds > 0 else 0.
+
+    def __str__(self):
+        actions = ', '.join('{}:{}'.format(track_id, action or 'pending..')
+                            for track_id, _, action, _ in self.persons)
+        state = 'done' if self.done else '{:.2f} fps'.format(self.mean_fps())
+        return '{} | {} frames, {} | persons: {}'.format(self.source, self.frames, state, actions or '-')
+
+
+if __name__ == '__main__':
+    par = argparse.ArgumentParser(description='Human Fall Detection on several cameras.')
+    par.add_argument('-C', '--camera', nargs='+', required=True,
+                     help='Sources of camera or video file path, one process each.')
+    par.add_argument('--detection_input_size', type=int, default=384,
+                     help='Size of input in detection model (divisible by 32).')
+    par.add_argument('--pose_input_size', type=str, default='224x160',
+                     help='Input size (HxW) for pose model (divisible by 32).')
+    par.add_argument('--pose_backbone', type=str, default='resnet50',
+                     help='Backbone for SPPE FastPose model.')
+    par.add_argument('--device', type=str, default='cpu', help='Device: cpu or cuda.')
+    par.add_argument('--precision', type=str, default='fp32', choices=PRECISIONS,
+                     help='Inference precision / memory format of the three models.')
+    par.add_argument('--int8', default=False, action='store_true',
+                     help='Use the INT8 pose and action models saved by quantization.py (cpu only).')
+    par.add_argument('--action_stride', type=int, default=4,
+                     help='Run the action model of each track every N frames, 1 for every frame.')
+    par.add_argument('--threads', type=int, default=0,
+                     help='Torch threads of each process, 0 to share the cores between the cameras.')
+    par.add_argument('--report_interval', type=float, default=5.,
+                     help='Seconds between two reports of all cameras.')
+    args = par.parse_args()
+
+    n_cams = len(args.camera)
+    if args.threads <= 0:
+        args.threads = max(1, (os.cpu_count() or 1) // n_cams)
+    if n_cams > (os.cpu_count() or 1):
+        print(f"[WARN] {n_cams} 路视频多于 CPU 核数 {os.cpu_count()}，各路帧率会下降。")
+
+    # spawn: 每个进程独立初始化 torch / OpenCV，不继承父进程的线程状态
+    ctx = mp.get_context('spawn')
+    results = ctx.Queue()
+    reports = [CameraReport(source) for source in args.camera]
+    workers = [ctx.Process(target=run_camera, args=(i, source, args, results), daemon=True)
+               for i, source in enumerate(args.camera)]
+    for w in workers:
+        w.start()
+    print(f"[MULTI] {n_cams} 路视频，每路 torch 线程数: {args.threads}")
+
+    report_time = time.time()
+    try:
+        while not all(r.done for r in reports):
+            try:
+                msg = results.get(timeout=1)
+            except Empty:
+                for i, w in enumerate(workers):
+                    if not w.is_alive() and not reports[i].done:
+                        reports[i].done = True
+                        reports[i].seconds = time.time() - reports[i].start
+                        reports[i].error = f'进程退出，exitcode={w.exitcode}'
+                        print(f"[ERR] {args.camera[i]}: {reports[i].error}")
+                msg = None
+
+            if msg is not None and msg[0] == FRAME:
+                _, i, frame, fps, persons = msg
+                for track_id, score in reports[i].add(frame, fps, persons):
+                    print(f"[ALERT] {args.camera[i]} 帧 {frame}: 目标 {track_id} 跌倒 ({score * 100:.1f}%)")
+            elif msg is not None and msg[0] == DONE:
+                _, i, frame, seconds, error = msg
+                reports[i].frames = frame
+                reports[i].seconds = seconds
+                reports[i].done = True
+                reports[i].error = error
+                if error is not None:
+                    print(f"[ERR] {args.camera[i]}:\n{error}")
+
+            if time.time() - report_time >= args.report_interval:
+                report_time = time.time()
+                for i, r in enumerate(reports):
+                    print(f"[CAM{i}] {r}")
+
+    except KeyboardInterrupt:
+        print("[MULTI] 中断，停止所有进程。")
+    finally:
+        for w in workers:
+            w.join(timeout=2)
+            if w.is_alive():
+                w.terminate()
+        for i, r in enumerate(reports):
+            print(f"[DONE] CAM{i} {r.source}: {r.frames} 帧, 平均 FPS {r.total_fps():.2f}, 跌倒次数 {r.falls}")
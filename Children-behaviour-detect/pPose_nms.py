@@ -26,134 +26,126 @@ def pose_nms(bboxes, bbox_scores, pose_preds, pose_scores):
     bbox_scores:    bbox scores list (n,)
     pose_preds:     pose locations list (n, 17, 2)
     pose_scores:    pose scores list    (n, 17, 1)
-    """
-    global ori_pose_preds, ori_pose_scores, ref_dists
 
-    pose_scores[pose_scores == 0] = 1e-5
+    The keypoint distances of every pair of poses are computed once, the greedy
+    picking only reads rows of the resulting suppression matrix and the poses of
+    all picks are merged together. Nothing is kept between calls, so it is safe
+    to run from several threads at once.
+    """
+    nsamples = bboxes.shape[0]
+    if nsamples == 0:
+        return []
 
-    final_result = []
+    pose_scores = pose_scores.masked_fill(pose_scores == 0, 1e-5)
+    kp_scores = pose_scores[:, :, 0]
 
-    ori_bboxes = bboxes.clone()
-    ori_bbox_scores = bbox_scores.clone()
-    ori_pose_preds = pose_preds.clone()
-    ori_pose_scores = pose_scores.clone()
+    widths = bboxes[:, 2] - bboxes[:, 0]
+    heights = bboxes[:, 3] - bboxes[:, 1]
+    ref_dists = alpha * torch.max(widths, heights)
 
-    xmax = bboxes[:, 2]
-    xmin = bboxes[:, 0]
-    ymax = bboxes[:, 3]
-    ymin = bboxes[:, 1]
+    # Distance of each keypoint between every two poses -- [n, n, 17]
+    dist = torch.sqrt(torch.sum(
+        torch.pow(pose_preds[:, np.newaxis] - pose_preds[np.newaxis], 2),
+        dim=3
+    ))
 
-    widths = xmax - xmin
-    heights = ymax - ymin
-    ref_dists = alpha * np.maximum(widths, heights)
+    # get_parametric_distance and PCK_match of every pose against every other.
+    score_dists = torch.tanh(kp_scores[:, np.newaxis] / delta1) * torch.tanh(kp_scores[np.newaxis] / delta1)
+    simi = torch.sum(score_dists * (dist <= 1), dim=2) + mu * torch.sum(torch.exp((-1) * dist / delta2), dim=2)
+    num_match_keypoints = torch.sum(dist / torch.clamp(ref_dists, max=7)[:, None, None] <= 1, dim=2)
+    suppress = ((simi > gamma) | (num_match_keypoints >= matchThreds)).numpy()
 
-    nsamples = bboxes.shape[0]
-    human_scores = pose_scores.mean(dim=1)
-
-    human_ids = np.arange(nsamples)
-    # Do pPose-NMS
+    # Do pPose-NMS: pick the highest score left, it takes all the ones it suppresses.
+    human_scores = pose_scores.mean(dim=1)[:, 0]
+    order = torch.sort(human_scores, descending=True, stable=True)[1].numpy()
+    alive = np.ones(nsamples, dtype=bool)
     pick = []
     merge_ids = []
-    while human_scores.shape[0] != 0:
-        # Pick the one with highest score
-        pick_id = torch.argmax(human_scores)
-        pick.append(human_ids[pick_id])
-        # num_visPart = torch.sum(pose_scores[pick_id] > 0.2)
-
-        # Get numbers of match keypoints by calling PCK_match
-        ref_dist = ref_dists[human_ids[pick_id]]
-        simi = get_parametric_distance(pick_id, pose_preds, pose_scores, ref_dist)
-        num_match_keypoints = PCK_match(pose_preds[pick_id], pose_preds, ref_dist)
-
-        # Delete humans who have more than matchThreds keypoints overlap and high similarity
-        delete_ids = torch.from_numpy(np.arange(human_scores.shape[0]))[
-            (simi > gamma) | (num_match_keypoints >= matchThreds)]
-
-        if delete_ids.shape[0] == 0:
-            delete_ids = pick_id
-        #else:
-        #    delete_ids = torch.from_numpy(delete_ids)
-
-        merge_ids.append(human_ids[delete_ids])
-        pose_preds = np.delete(pose_preds, delete_ids, axis=0)
-        pose_scores = np.delete(pose_scores, delete_ids, axis=0)
-        human_ids = np.delete(human_ids, delete_ids)
-        human_scores = np.delete(human_scores, delete_ids, axis=0)
-        bbox_scores = np.delete(bbox_scores, delete_ids, axis=0)
-
-    assert len(merge_ids) == len(pick)
-    bboxs_pick = ori_bboxes[pick]
-    preds_pick = ori_pose_preds[pick]
-    scores_pick = ori_pose_scores[pick]
-    bbox_scores_pick = ori_bbox_scores[pick]
-    #final_result = pool.map(filter_result, zip(scores_pick, merge_ids, preds_pick, pick, bbox_scores_pick))
-    #final_result = [item for item in final_result if item is not None]
-
-    for j in range(len(pick)):
-        ids = np.arange(pose_preds.shape[1])
-        max_score = torch.max(scores_pick[j, ids, 0])
-
-        if max_score < scoreThreds:
-            continue
-
-        # Merge poses
-        merge_id = merge_ids[j]
-        merge_pose, merge_score = p_merge_fast(
-            preds_pick[j], ori_pose_preds[merge_id], ori_pose_scores[merge_id], ref_dists[pick[j]])
-
-        max_score = torch.max(merge_score[ids])
-        if max_score < scoreThreds:
+    for i in order:
+        if not alive[i]:
             continue
-
-        xmax = max(merge_pose[:, 0])
-        xmin = min(merge_pose[:, 0])
-        ymax = max(merge_pose[:, 1])
-        ymin = min(merge_pose[:, 1])
-
-        if 1.5 ** 2 * (xmax - xmin) * (ymax - ymin) < areaThres:
-            continue
-
+        cluster = suppress[i] & alive
+        cluster[i] = True
+        alive[cluster] = False
+        pick.append(i)
+        merge_ids.append(cluster)
+
+    pick = torch.from_numpy(np.array(pick))
+    merge_ids = torch.from_numpy(np.stack(merge_ids))
+
+    # p_merge_fast of every pick with its cluster -- [p, n, 17, 1]
+    mask = merge_ids[:, :, None] & (dist[pick] <= torch.clamp(ref_dists[pick], max=15)[:, None, None])
+    masked_scores = pose_scores[np.newaxis] * mask.unsqueeze(-1).float()
+    normed_scores = masked_scores / torch.sum(masked_scores, dim=1, keepdim=True)
+    merge_poses = torch.sum(pose_preds[np.newaxis] * normed_scores, dim=1)
+    merge_scores = torch.sum(masked_scores * normed_scores, dim=1)
+
+    xmax = merge_poses[:, :, 0].max(1)[0]
+    xmin = merge_poses[:, :, 0].min(1)[0]
+    ymax = merge_poses[:, :, 1].max(1)[0]
+    ymin = merge_poses[:, :, 1].min(1)[0]
+    keep = ~(pose_scores[pick].flatten(1).max(1)[0] < scoreThreds) & \
+           ~(merge_scores.flatten(1).max(1)[0] < scoreThreds) & \
+           ~(1.5 ** 2 * (xmax - xmin) * (ymax - ymin) < areaThres)
+
+    bboxs_pick = bboxes[pick]
+    bbox_scores_pick = bbox_scores[pick]
+    final_result = []
+    for j in np.flatnonzero(keep.numpy()):
         final_result.append({
             'bbox': bboxs_pick[j],
             'bbox_score': bbox_scores_pick[j],
-            'keypoints': merge_pose - 0.3,
-            'kp_score': merge_score,
-            'proposal_score': torch.mean(merge_score) + bbox_scores_pick[j] + 1.25 * max(merge_score)
+            'keypoints': merge_poses[j] - 0.3,
+            'kp_score': merge_scores[j],
+            'proposal_score': torch.mean(merge_scores[j]) + bbox_scores_pick[j] + 1.25 * merge_scores[j].max(0)[0]
         })
 
     return final_result
 
 
-def filter_result(args):
-    score_pick, merge_id, pred_pick, pick, bbox_score_pick = args
-    global ori_pose_preds, ori_pose_scores, ref_dists
-    ids = np.arange(17)
-    max_score = torch.max(score_pick[ids, 0])
-
-    if max_score < scoreThreds:
-        return None
-
-    # Merge poses
-    merge_pose, merge_score = p_merge_fast(
-        pred_pick, ori_pose_preds[merge_id], ori_pose_scores[merge_id], ref_dists[pick])
-
-    max_score = torch.max(merge_score[ids])
-    if max_score < scoreThreds:
-        return None
-
-    xmax = max(merge_pose[:, 0])
-    xmin = min(merge_pose[:, 0])
-    ymax = max(merge_pose[:, 1])
-    ymin = min(merge_pose[:, 1])
+def poses_overlap(pose_preds):
+    """
+    Whether any two poses have keypoints close enough for pose_nms to suppress
+    one of them. A pose is only suppressed by one with some of the same
+    keypoints within 7 pixels (PCK_match) or 1 pixel (get_parametric_distance),
+    so poses whose keypoint boxes are further apart than that are all kept.
+    pose_preds:     pose locations list (n, 17, 2)
+    """
+    if pose_preds.shape[0] < 2:
+        return False
+    # 1 pixel of margin over the 7 of PCK_match for the rounding of the distances.
+    lo = pose_preds.min(dim=1)[0] - 8
+    hi = pose_preds.max(dim=1)[0]
+    close = torch.all((lo[:, None] <= hi[None]) & (lo[None] <= hi[:, None]), dim=2)
+    close.fill_diagonal_(False)
+    return bool(close.any())
 
-    if 1.5 ** 2 * (xmax - xmin) * (ymax - ymin) < 40 * 40.5:
-        return None
 
-    return {
-        'keypoints': merge_pose - 0.3,
-        'kp_score': merge_score,
-        'proposal_score': torch.mean(merge_score) + bbox_score_pick + 1.25 * max(merge_score)
-    }
+def pose_nms_disjoint(bboxes, bbox_scores, pose_preds, pose_scores):
+    """
+    Result of pose_nms when no poses overlap (see poses_overlap): every pose is
+    its own cluster, so the merge leaves it as is and only the score filters
+    apply. Same arguments and output as pose_nms.
+    """
+    pose_scores = pose_scores.masked_fill(pose_scores == 0, 1e-5)
+    order = torch.sort(pose_scores.mean(dim=1)[:, 0], descending=True, stable=True)[1]
+
+    max_scores = pose_scores.flatten(1).max(1)[0]
+    areas = 1.5 ** 2 * torch.prod(pose_preds.max(1)[0] - pose_preds.min(1)[0], dim=1)
+    order = order[~(max_scores[order] < scoreThreds) & ~(areas[order] < areaThres)]
+
+    bboxs_pick = bboxes[order]
+    bbox_scores_pick = bbox_scores[order]
+    keypoints = pose_preds[order] - 0.3
+    kp_scores = pose_scores[order]
+    proposal_scores = kp_scores.mean(dim=(1, 2)) + bbox_scores_pick + 1.25 * max_scores[order]
+    return [{
+        'bbox': bboxs_pick[j],
+        'bbox_score': bbox_scores_pick[j],
+        'keypoints': keypoints[j],
+        'kp_score': kp_scores[j],
+        'proposal_score': proposal_scores[j:j + 1]
+    } for j in range(len(order))]
 
 
 def p_merge(ref_pose, cluster_preds, cluster_scores, ref_dist):
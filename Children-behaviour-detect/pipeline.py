@@ -0,0 +1,164 @@
+import threading
+
+from queue import Queue, Empty, Full
+
+# Marks the end of the stream in the queues.
+END = object()
+
+
+class PipelineStopped(Exception):
+    pass
+
+
+class Stage(object):
+    """A step of a `Pipeline`.
+    Args:
+        fn: (callable) Takes the item of the previous stage, returns the item of the next one.
+        workers: (int) Threads running `fn`. Keep 1 for a stage with state (like the
+            tracker), it then sees the items in order. A stateless stage can have more,
+            the next stage still gets its items back in order.
+        name: (str) Name of the stage threads.
+    """
+    def __init__(self, fn, workers=1, name=None):
+        assert workers >= 1, 'A stage needs at least one worker!'
+        self.fn = fn
+        self.workers = workers
+        self.name = name or getattr(fn, '__name__', 'stage')
+
+
+class Pipeline(object):
+    """Run the steps of processing a stream concurrently, each in its own threads and
+    linked by bounded queues, so one frame is detected while the previous one is
+    tracked and the one before that is drawn. A full queue blocks the stage before it,
+    so a slow stage slows the source instead of piling up frames.
+
+    Every item is numbered by the order the source gave it, and each stage takes its
+    items in that order, so the output is in order.
+
+    Args:
+        source: (callable) Returns the next item, or None at the end of the stream.
+        stages: (list of Stage or callable) Steps to run on every item, in order.
+        queue_size: (int) Items waiting between two stages.
+    """
+    def __init__(self, source, stages, queue_size=2):
+        self.source = source
+        self.stages = [s if isinstance(s, Stage) else Stage(s) for s in stages]
+        n = len(self.stages) + 1
+        self.queues = [Queue(maxsize=queue_size) for _ in range(n)]
+        # Items taken out of order, by queue.
+        self.pending = [{} for _ in range(n)]
+        self.next_seq = [0] * n
+        self.end_seq = [None] * n
+        self.locks = [threading.Lock() for _ in range(n)]
+        self.running = [stage.workers for stage in self.stages]
+
+        self.stopped = threading.Event()
+        self.error = None
+        self.threads = []
+
+    def start(self):
+        self.threads.append(threading.Thread(target=self._run, args=(self._source, None), name='source',
+                                             daemon=True))
+        for i, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                self.threads.append(threading.Thread(target=self._run, args=(self._stage, i), name=stage.name,
+                                                     daemon=True))
+        for t in self.threads:
+            t.start()
+        return self
+
+    def get(self):
+        """Get the next output `(seq, item)` in order, None at the end of the stream.
+        Raises the error of a failed stage.
+        """
+        try:
+            seq, item = self._take(len(self.stages))
+        except PipelineStopped:
+            item = END
+        if self.error is not None:
+            raise self.error
+        if item is END:
+            if self.stopped.is_set():
+                raise PipelineStopped()
+            return None
+        return seq, item
+
+    def __iter__(self):
+        while True:
+            out = self.get()
+            if out is None:
+                return
+            yield out
+
+    def stop(self):
+        self.stopped.set()
+        for t in self.threads:
+            t.join(timeout=1)
+
+    def _put(self, i, entry):
+        while True:
+            if self.stopped.is_set():
+                raise PipelineStopped()
+            try:
+                self.queues[i].put(entry, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def _take(self, i):
+        """Next `(seq, item)` of queue `i` in sequence order, END for every taker once it ends."""
+        with self.locks[i]:
+            while True:
+                if self.end_seq[i] is not None and self.next_seq[i] >= self.end_seq[i]:
+                    return self.end_seq[i], END
+                if self.next_seq[i] in self.pending[i]:
+                    seq = self.next_seq[i]
+                    self.next_seq[i] += 1
+                    return seq, self.pending[i].pop(seq)
+                if self.stopped.is_set() and self.error is not None:
+                    return self.next_seq[i], END
+                try:
+                    seq, item = self.queues[i].get(timeout=0.1)
+                except Empty:
+                    if self.stopped.is_set():
+                        raise PipelineStopped()
+                    continue
+                if item is END:
+                    self.end_seq[i] = seq
+                else:
+                    self.pending[i][seq] = item
+
+    def _run(self, target, i):
+        try:
+            target(i)
+        except PipelineStopped:
+            pass
+        except Exception as e:
+            # Stop every stage and raise it to the reader of the output.
+            self.error = e
+            self.stopped.set()
+
+    def _source(self, _):
+        seq = 0
+        while True:
+            item = self.source()
+            if item is None:
+                break
+            self._put(0, (seq, item))
+            seq += 1
+        self._put(0, (seq, END))
+
+    def _stage(self, i):
+        fn = self.stages[i].fn
+        while True:
+            seq, item = self._take(i)
+            if item is END:
+                break
+            self._put(i + 1, (seq, fn(item)))
+
+        # The last worker of the stage to finish passes the end on.
+        with self.locks[i]:
+            self.running[i] -= 1
+            last = self.running[i] == 0
+        if last:
+            self._put(i + 1, (seq, END))
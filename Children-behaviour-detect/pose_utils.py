@@ -3,25 +3,29 @@ import numpy as np
 
 def normalize_points_with_size(xy, width, height, flip=False):
     """Normalize scale points in image with size of image to (0-1).
-    xy : (frames, parts, xy) or (parts, xy)
+    xy : (persons, frames, parts, xy), (frames, parts, xy) or (parts, xy)
     """
     if xy.ndim == 2:
         xy = np.expand_dims(xy, 0)
-    xy[:, :, 0] /= width
-    xy[:, :, 1] /= height
+    xy[..., 0] /= width
+    xy[..., 1] /= height
     if flip:
-        xy[:, :, 0] = 1 - xy[:, :, 0]
+        xy[..., 0] = 1 - xy[..., 0]
     return xy
 
 
+def kpt2bbox(kpt, ex=20):
+    return np.array((kpt[:, 0].min() - ex, kpt[:, 1].min() - ex,
+                     kpt[:, 0].max() + ex, kpt[:, 1].max() + ex))
+
+
 def scale_pose(xy):
     """Normalize pose points by scale with max/min value of each pose.
-    xy : (frames, parts, xy) or (parts, xy)
+    xy : (persons, frames, parts, xy), (frames, parts, xy) or (parts, xy)
     """
     if xy.ndim == 2:
         xy = np.expand_dims(xy, 0)
-    xy_min = np.nanmin(xy, axis=1)
-    xy_max = np.nanmax(xy, axis=1)
-    for i in range(xy.shape[0]):
-        xy[i] = ((xy[i] - xy_min[i]) / (xy_max[i] - xy_min[i])) * 2 - 1
+    xy_min = np.nanmin(xy, axis=-2, keepdims=True)
+    xy_max = np.nanmax(xy, axis=-2, keepdims=True)
+    xy = ((xy - xy_min) / (xy_max - xy_min)) * 2 - 1
     return xy.squeeze()
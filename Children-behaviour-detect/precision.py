@@ -0,0 +1,43 @@
+import contextlib
+import torch
+
+PRECISIONS = ('fp32', 'bf16', 'channels_last', 'bf16_channels_last')
+
+
+class Precision(object):
+    """Inference precision and memory format shared by the model loaders.
+    Args:
+        precision: (str) One of `PRECISIONS`:
+            'fp32': float32 NCHW, as the models are trained.,
+            'bf16': bfloat16 autocast, faster on CPUs with AVX512-BF16 or AMX.,
+            'channels_last': float32 with NHWC memory format for the convolutions.,
+            'bf16_channels_last': both of them.
+        device: (str) Device the model runs on 'cpu' or 'cuda'.
+    """
+    def __init__(self, precision='fp32', device='cpu'):
+        assert precision in PRECISIONS, '{} precision is not support yet!'.format(precision)
+        self.name = precision
+        self.device_type = torch.device(device).type
+        self.bf16 = precision.startswith('bf16')
+        self.channels_last = precision.endswith('channels_last')
+
+    def prepare_model(self, model):
+        """Convert the weights of `model` to the memory format, once after loading."""
+        if self.channels_last:
+            model = model.to(memory_format=torch.channels_last)
+        return model
+
+    def prepare_input(self, x):
+        """Convert a 4-D input batch to the memory format of the model."""
+        if self.channels_last and x.dim() == 4:
+            x = x.contiguous(memory_format=torch.channels_last)
+        return x
+
+    def autocast(self):
+        """Context to run the forward pass in, outputs are bfloat16 when enabled."""
+        if self.bf16:
+            return torch.autocast(self.device_type, dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+
+    def __repr__(self):
+        return self.name
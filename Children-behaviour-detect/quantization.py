@@ -0,0 +1,117 @@
+"""INT8 post-training quantization of the pose and action models for CPU inference.
+
+The models are quantized statically (weights and activations), as they are made
+of convolutions, which dynamic quantization does not cover. The activation
+ranges are calibrated on a few recorded samples, then the INT8 state dict is
+saved next to the float weights and loaded by `SPPE_FastPose` and `TSSTG` with
+`quantized=True`.
+
+Usage:
+    python quantization.py --clip <recorded video>
+"""
+import os
+import copy
+import torch
+import warnings
+
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+BACKEND = 'x86'
+
+
+def quantized_weight_file(weight_file):
+    """Path of the INT8 state dict saved next to the float `weight_file`."""
+    return os.path.splitext(weight_file)[0] + '-int8.pth'
+
+
+def prepare(model, example_input, backend=BACKEND):
+    torch.backends.quantized.engine = backend
+    return prepare_fx(copy.deepcopy(model).eval(), get_default_qconfig_mapping(backend), (example_input,))
+
+
+def quantize_static(model, calib_inputs, backend=BACKEND):
+    """Quantize a float model to INT8.
+    Args:
+        model: (nn.Module) Float model in eval mode, it is left unchanged.
+        calib_inputs: (list) Model inputs to observe the activation ranges on,
+            the first one is also used to trace the model.
+        backend: (str) Quantized engine the model will run on.
+    Returns:
+        (torch.fx.GraphModule) The quantized model, taking and returning float tensors.
+    """
+    prepared = prepare(model, calib_inputs[0], backend)
+    with torch.no_grad():
+        for x in calib_inputs:
+            prepared(x)
+    return convert_fx(prepared)
+
+
+def load_quantized(model, example_input, weight_file, backend=BACKEND):
+    """Rebuild the quantized model of a float model and load its INT8 state dict.
+    Args:
+        model: (nn.Module) Float model of the same structure as the quantized one.
+        example_input: Any valid input of the model, to trace it.
+        weight_file: (str) State dict saved from the `quantize_static` result.
+        backend: (str) Quantized engine the model will run on.
+    Returns:
+        (torch.fx.GraphModule) The quantized model.
+    """
+    prepared = prepare(model, example_input, backend)
+    with warnings.catch_warnings():
+        # No calibration here, the scales and zero points come from the state dict.
+        warnings.simplefilter('ignore')
+        quantized = convert_fx(prepared)
+    quantized.load_state_dict(torch.load(weight_file, map_location='cpu'))
+    return quantized
+
+
+if __name__ == '__main__':
+    import argparse
+    import numpy as np
+
+    from DetectorLoader import TinyYOLOv3_onecls
+    from PoseEstimateLoader import SPPE_FastPose
+    from ActionsEstLoader import TSSTG
+    from Detection.Utils import merge_track_boxes, read_clip
+    from Track.Tracker import Detection, Tracker
+    from pose_utils import kpt2bbox
+
+    par = argparse.ArgumentParser(description='Calibrate and save the INT8 pose and action models.')
+    par.add_argument('--clip', type=str, required=True, help='Recorded video to calibrate on.')
+    par.add_argument('--frames', type=int, default=150, help='Frames of the clip to use.')
+    par.add_argument('--samples', type=int, default=32, help='Calibration batches of each model.')
+    par.add_argument('--detection_input_size', type=int, default=384,
+                     help='Size of input in detection model (divisible by 32).')
+    par.add_argument('--pose_input_size', type=str, default='224x160',
+                     help='Input size (HxW) for pose model (divisible by 32).')
+    args = par.parse_args()
+
+    frames = read_clip(args.clip, args.detection_input_size, args.frames)
+    ph, pw = map(int, args.pose_input_size.split('x'))
+    detect_model = TinyYOLOv3_onecls(args.detection_input_size, device='cpu')
+    pose_model = SPPE_FastPose('resnet50', ph, pw, device='cpu')
+    action_model = TSSTG()
+    tracker = Tracker(max_age=30, n_init=3)
+
+    # Frames with their pose boxes, and 30 frames skeleton windows of the tracks, of the fp32 pipeline.
+    crops, windows = [], []
+    for frame in frames:
+        detected = detect_model.detect(frame, need_resize=False, expand_bb=10)
+        tracker.predict()
+        detected = merge_track_boxes(detected, [track.to_tlbr() for track in tracker.tracks], object_conf=0.5)
+        poses = []
+        if detected is not None:
+            crops.append((frame, detected[:, 0:4]))
+            poses = pose_model.predict(frame, detected[:, 0:4], detected[:, 4])
+        tracker.update([Detection(kpt2bbox(ps['keypoints'].numpy()),
+                                  np.concatenate((ps['keypoints'].numpy(), ps['kp_score'].numpy()), axis=1),
+                                  ps['kp_score'].mean().numpy()) for ps in poses])
+        windows += [track.keypoints_list.window().copy() for track in tracker.tracks
+                    if track.is_confirmed() and len(track.keypoints_list) == 30]
+    assert len(crops) and len(windows), 'No person tracked long enough in {}!'.format(args.clip)
+
+    pick = np.linspace(0, len(crops) - 1, min(args.samples, len(crops))).astype(int)
+    print('Saved', pose_model.quantize([crops[i] for i in pick]))
+    pick = np.linspace(0, len(windows) - 1, min(args.samples, len(windows))).astype(int)
+    print('Saved', action_model.quantize([windows[i] for i in pick], frames[0].shape[:2]))
@@ -4,10 +4,12 @@
 
 import os, time, re
 import speech_recognition as sr
+from speech_stream import SpeechStream
+from speech_backends import make_backend, VOSK_MODEL
+from mode_classifier import ModeClassifier, PhraseIndex
 import serial, serial.tools.list_ports
 from sentence_transformers import SentenceTransformer
 import joblib
-import numpy as np
 from collections import deque
 os.add_dll_directory(r'C:\Program Files\VideoLAN\VLC')
 import vlc
@@ -105,16 +107,23 @@ def open_serial():
     return ser
 
 # Speech recognition
+# backend spec, see speech_backends.py: "google", "vosk", "google+vosk" (offline fallback), "text:commands.txt"
+STT_BACKEND = os.environ.get("STT_BACKEND", "google+vosk" if os.path.isdir(VOSK_MODEL) else "google")
 rec = sr.Recognizer()
-mic = sr.Microphone()
+stt = make_backend(STT_BACKEND, rec)
+print(f"[stt] backend: {stt.name}")
+# one microphone stream for the whole session: no reopening / noise calibration per command
+speech = None  # opened on first use, the text stand-in needs no microphone
 
 def transcribe_once() -> str | None:
-    with mic as source:
-        rec.adjust_for_ambient_noise(source, duration=0.4)
-        print("Listening...")
-        audio = rec.listen(source, phrase_time_limit=8)
+    global speech
+    audio = None
+    if stt.needs_audio:
+        if speech is None:
+            speech = SpeechStream(sr.Microphone(), pause=rec.pause_threshold, phrase_limit=8).start()
+        audio = speech.get().audio
     try:
-        text = rec.recognize_google(audio)
+        text = stt.transcribe(audio)
         if PRINT_TRANSCRIPTS:
             print(f"You said: {text}")
         return text
@@ -132,11 +141,13 @@ clf = joblib.load("model_classifier_augmented.pkl")
 
 LABEL_MAP = {0: "MODE:SLEEP", 1: "MODE:PLAY", 2: "MODE:FOCUS"}
 
+# training phrases answered without the transformer (exact / near-exact match)
+DATASET_PATHS = ["dataset.jsonl", "Trainers/dataset.jsonl"]
+phrase_index = next((PhraseIndex.from_jsonl(p) for p in DATASET_PATHS if os.path.exists(p)), None)
+classifier = ModeClassifier(embedder, clf, index=phrase_index)
+
 def classify_mode_local(text: str):
-    vec = embedder.encode([text])
-    probs = clf.predict_proba(vec)[0]
-    pred = int(np.argmax(probs))
-    conf = float(np.max(probs))
+    pred, conf, source = classifier.predict(text)
 
     if conf < CONF_THRESHOLD:
         print(f"(low confidence: {conf:.2f} — ignoring)")
@@ -186,4 +197,10 @@ def main():
             print(f"(holding mode: {last_sent})")
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    except (KeyboardInterrupt, EOFError):  # EOFError: end of the text stand-in
+        pass
+    finally:
+        print(stt.report())
+        print(classifier.stats())
@@ -7,12 +7,15 @@
 
 import os
 import time
+import asyncio
 import threading
 import serial, serial.tools.list_ports
 import speech_recognition as sr
+from speech_stream import SpeechStream
+from speech_backends import make_backend, VOSK_MODEL
+from mode_classifier import ModeClassifier, PhraseIndex
 from sentence_transformers import SentenceTransformer
 import joblib
-import numpy as np
 from collections import deque
 import tkinter as tk
 import vlc
@@ -43,6 +46,11 @@ embedder = SentenceTransformer("embedder_augmented")
 clf = joblib.load("model_classifier_augmented.pkl")
 LABEL_MAP = {0: "MODE:SLEEP", 1: "MODE:PLAY", 2: "MODE:FOCUS"}
 
+# training phrases answered without the transformer (exact / near-exact match)
+DATASET_PATHS = ["dataset.jsonl", "Trainers/dataset.jsonl"]
+phrase_index = next((PhraseIndex.from_jsonl(p) for p in DATASET_PATHS if os.path.exists(p)), None)
+classifier = ModeClassifier(embedder, clf, index=phrase_index)
+
 # ========== VIDEO PATHS ==========
 # You have 6 videos: 3 inflate + 3 deflate
 VIDEO_PATHS = {
@@ -52,16 +60,23 @@ VIDEO_PATHS = {
 }
 
 # ========== SPEECH RECOGNITION ==========
+# backend spec, see speech_backends.py: "google", "vosk", "google+vosk" (offline fallback), "text:commands.txt"
+STT_BACKEND = os.environ.get("STT_BACKEND", "google+vosk" if os.path.isdir(VOSK_MODEL) else "google")
 rec = sr.Recognizer()
-mic = sr.Microphone()
+stt = make_backend(STT_BACKEND, rec)
+print(f"[stt] backend: {stt.name}")
+# one microphone stream for the whole session: no reopening / noise calibration per command
+speech = None  # opened on first use, the text stand-in needs no microphone
 
 def transcribe_once() -> str | None:
-    with mic as source:
-        rec.adjust_for_ambient_noise(source, duration=0.4)
-        print("🎤 Listening...")
-        audio = rec.listen(source, phrase_time_limit=8)
+    global speech
+    audio = None
+    if stt.needs_audio:
+        if speech is None:
+            speech = SpeechStream(sr.Microphone(), pause=rec.pause_threshold, phrase_limit=8).start()
+        audio = speech.get().audio
     try:
-        text = rec.recognize_google(audio)
+        text = stt.transcribe(audio)
         if PRINT_TRANSCRIPTS:
             print(f"You said: {text}")
         return text
@@ -91,14 +106,11 @@ def open_serial():
 
 # ========== CLASSIFIER HELPERS ==========
 def classify_mode_local(text: str):
-    vec = embedder.encode([text])
-    probs = clf.predict_proba(vec)[0]
-    pred = int(np.argmax(probs))
-    conf = float(np.max(probs))
+    pred, conf, source = classifier.predict(text)
     if conf < CONF_THRESHOLD:
         print(f"(low confidence: {conf:.2f} — ignoring)")
         return None
-    print(f"[classifier] predicted {LABEL_MAP[pred]} ({conf:.2f})")
+    print(f"[classifier] predicted {LABEL_MAP[pred]} ({conf:.2f}, {source})")
     return pred
 
 def mode_to_command(m: int) -> str:
@@ -119,92 +131,180 @@ root.update_idletasks()
 player.set_hwnd(embed_frame.winfo_id())
 
 # ========== VIDEO CONTROL ==========
-player_busy = threading.Event()
+player_busy = threading.Event()  # set while a clip that is not the looped last one plays
 current_mode = "MODE:SLEEP"  # start mode
 
-def play_video(path: str, block=False, loop=False, timeout=30):
-    """Play a video. Optionally block until finished (with timeout) or loop manually."""
-    global player_busy
-    if not os.path.exists(path):
-        print(f"[video] Missing file: {path}")
+# Parse the six clips once at startup and reuse the Media objects for every transition.
+def preload_media() -> dict:
+    cache = {}
+    for clips in VIDEO_PATHS.values():
+        for path in clips.values():
+            if not os.path.exists(path):
+                print(f"[video] Missing file: {path}")
+                continue
+            media = instance.media_new(path)
+            media.parse_with_options(vlc.MediaParseFlag.local, 3000)
+            cache[path] = media
+    print(f"[video] preloaded {len(cache)} clips")
+    return cache
+
+media_cache = preload_media()
+
+# Clips of a transition are one playlist: VLC opens the next clip itself when the
+# previous one ends, without a stop / new media / black frames in between.
+list_player = instance.media_list_player_new()
+list_player.set_media_player(player)
+
+playlist = []          # libvlc_media_t pointers of the playlist being played
+switch = {}            # timestamps of the current transition, filled by the VLC events
+
+def on_playing(event):
+    now = time.perf_counter()
+    if switch.get("item") not in playlist:
+        return  # late event of the previous playlist
+    if "first" not in switch:
+        switch["first"] = now
+    elif "ended" in switch and "handoff" not in switch:
+        switch["handoff"] = now
+
+def on_end_reached(event):
+    switch.setdefault("ended", time.perf_counter())
+
+def on_next_item(event):
+    # event.u.media is the raw pointer (an int), compared without calling libvlc from its event thread
+    switch["item"] = event.u.media
+    if playlist and event.u.media == playlist[-1]:
+        player_busy.clear()  # the last clip started, it gets looped
+
+em = player.event_manager()
+em.event_attach(vlc.EventType.MediaPlayerPlaying, on_playing)
+em.event_attach(vlc.EventType.MediaPlayerEndReached, on_end_reached)
+list_player.event_manager().event_attach(vlc.EventType.MediaListPlayerNextItemSet, on_next_item)
+
+def play_clips(paths: list):
+    """Play the clips back to back, the last one looped. Returns at once, player_busy is
+    cleared when the last clip starts (call loop_last_clip then)."""
+    paths = [p for p in paths if p in media_cache]
+    if not paths:
+        print("[video] nothing to play")
         return
 
-    # Stop current playback
-    if player.is_playing():
-        player.stop()
-        time.sleep(0.3)
-
-    media = instance.media_new(path)
-    player.set_media(media)
-    player.play()
-    player_busy.set()
-    print(f"[video] playing {os.path.basename(path)}")
-
-    # Attach event BEFORE playback ends
-    def on_end(event):
-        print(f"[video] finished: {os.path.basename(path)}")
-        if loop:
-            print(f"[video] looping {os.path.basename(path)}")
-            player.play()
-        else:
-            player_busy.clear()
-
-    em = player.event_manager()
-    em.event_detach(vlc.EventType.MediaPlayerEndReached)
-    em.event_attach(vlc.EventType.MediaPlayerEndReached, on_end)
+    media_list = instance.media_list_new()
+    for path in paths:
+        media_list.add_media(media_cache[path])
+    playlist[:] = [media_cache[path]._as_parameter_.value for path in paths]
+    switch.clear()
+    switch["request"] = time.perf_counter()
 
-    # Blocking mode with timeout
-    if block:
-        start = time.time()
-        while player_busy.is_set():
-            time.sleep(0.1)
-            if time.time() - start > timeout:
-                print(f"[video] timeout waiting for {os.path.basename(path)} to finish")
-                player_busy.clear()
-                break
+    if len(paths) > 1:
+        player_busy.set()
+        list_player.set_playback_mode(vlc.PlaybackMode.default)
+    else:
+        player_busy.clear()
+        list_player.set_playback_mode(vlc.PlaybackMode.repeat)
+    list_player.set_media_list(media_list)
+    list_player.play_item_at_index(0)
+    print(f"[video] playing {' → '.join(os.path.basename(p) for p in paths)}")
+
+def loop_last_clip():
+    # not from on_next_item: libvlc must not be called back from its own event thread
+    list_player.set_playback_mode(vlc.PlaybackMode.repeat)
+
+async def report_switch(label: str, wait_for: str, timeout=2.0):
+    """Print the latency of the last play_clips once its `wait_for` event came: request →
+    first frame ("first"), and end of the first clip → next clip playing ("handoff")."""
+    start = time.time()
+    while wait_for not in switch and time.time() - start < timeout:
+        await asyncio.sleep(0.02)
+    parts = []
+    if "first" in switch:
+        parts.append(f"start {1000 * (switch['first'] - switch['request']):.0f} ms")
+    if "handoff" in switch:
+        parts.append(f"handoff {1000 * (switch['handoff'] - switch['ended']):.0f} ms")
+    print(f"[video] switch {label}: {', '.join(parts) or 'no playback event'}")
+
+
+# ========== TRANSITIONS ==========
+async def wait_video_end(modes: asyncio.Queue, timeout: float):
+    """Wait until the last clip of the playlist starts, the timeout, or a new mode is queued (pre-emption)."""
+    start = time.time()
+    while player_busy.is_set() and modes.empty():
+        await asyncio.sleep(0.1)
+        if time.time() - start > timeout:
+            print("[video] timeout waiting for the video to finish")
+            player_busy.clear()
+            break
 
 
-def transition_to_mode(new_mode: str):
-    """Play deflate of old mode, then inflate of new mode."""
+async def video_task(modes: asyncio.Queue):
+    """Play deflate of old mode, then inflate of new mode. A command arriving during the
+    deflate cuts it short: the newest queued mode is inflated right away."""
     global current_mode
-    if new_mode == current_mode:
-        print(f"[video] already in {new_mode}, skipping transition")
-        return
-
-    print(f"[video] Transition: {current_mode} → {new_mode}")
-
-    # 1️⃣ Deflate previous mode
-    deflate_path = VIDEO_PATHS.get(current_mode, {}).get("deflate")
-    if deflate_path:
-        play_video(deflate_path, block=True, timeout=25)
-    else:
-        print(f"[video] no deflate video for {current_mode}")
+    while True:
+        new_mode = await modes.get()
+        if new_mode == current_mode:
+            print(f"[video] already in {new_mode}, skipping transition")
+            modes.task_done()
+            continue
 
-    # 2️⃣ Inflate new mode (looped)
-    inflate_path = VIDEO_PATHS.get(new_mode, {}).get("inflate")
-    if inflate_path:
-        play_video(inflate_path, loop=True)
-    else:
-        print(f"[video] no inflate video for {new_mode}")
+        print(f"[video] Transition: {current_mode} → {new_mode}")
+        label = f"{current_mode} → {new_mode}"
+
+        # 1️⃣ Deflate previous mode, 2️⃣ then inflate new mode (looped), in one playlist
+        deflate_path = VIDEO_PATHS.get(current_mode, {}).get("deflate")
+        inflate_path = VIDEO_PATHS.get(new_mode, {}).get("inflate")
+        await asyncio.to_thread(play_clips, [deflate_path, inflate_path])
+        await wait_video_end(modes, timeout=25)
+
+        # newer commands heard meanwhile win, the old mode is already deflated
+        taken = 1
+        while not modes.empty():
+            queued = modes.get_nowait()
+            taken += 1
+            print(f"[video] pre-empted: {new_mode} → {queued}")
+            new_mode = queued
+
+        if taken > 1:
+            label = f"{label} → {new_mode} (pre-empted)"
+            await asyncio.to_thread(play_clips, [VIDEO_PATHS.get(new_mode, {}).get("inflate")])
+            await report_switch(label, "first")
+        else:
+            await asyncio.to_thread(loop_last_clip)
+            await report_switch(label, "handoff")
 
-    current_mode = new_mode
+        current_mode = new_mode
+        for _ in range(taken):
+            modes.task_done()
 
 
 # ========== INITIAL VIDEO ==========
-play_video(VIDEO_PATHS["MODE:SLEEP"]["inflate"], loop=True)
-
-# ========== MAIN VOICE + SERIAL LOOP ==========
-def voice_loop():
-    ser = open_serial()
-    last_sent = None
-    last_switch_ts = 0
+play_clips([VIDEO_PATHS["MODE:SLEEP"]["inflate"]])
+
+# ========== VOICE → CLASSIFIER → SERIAL → VIDEO TASKS ==========
+# Capture runs in the SpeechStream thread. Each other step is a task and the steps only
+# talk through queues, so a command is heard and classified while a transition plays.
+# None is passed down the queues at the end of the text stand-in, once the last
+# transition is done the loop ends.
+async def recognize_task(texts: asyncio.Queue):
     print("Say something like “I’m tired”, “let’s play music”, or “I need to focus”. CTRL+C to quit.")
     while True:
-        text = transcribe_once()
-        if not text:
-            continue
+        try:
+            text = await asyncio.to_thread(transcribe_once)  # waits for the next utterance + STT
+        except EOFError:  # end of the text stand-in
+            await texts.put(None)
+            return
+        if text:
+            await texts.put(text)
+
 
-        m = classify_mode_local(text)
+async def classify_task(texts: asyncio.Queue, commands: asyncio.Queue):
+    while True:
+        text = await texts.get()
+        if text is None:
+            await commands.put(None)
+            return
+
+        m = await asyncio.to_thread(classify_mode_local, text)
         if m is None:
             print("Please repeat.")
             continue
@@ -212,11 +312,22 @@ def voice_loop():
         cmd = mode_to_command(m)
         conversation_log.append({"text": text, "mode": cmd})
         print(f"[log] recent: {[c['mode'] for c in conversation_log]}")
+        await commands.put(cmd)
+
+
+async def serial_task(commands: asyncio.Queue, modes: asyncio.Queue):
+    ser = await asyncio.to_thread(open_serial)
+    last_sent = None
+    last_switch_ts = 0
+    while True:
+        cmd = await commands.get()
+        if cmd is None:
+            return
 
         now = time.time()
         if cmd != last_sent and (last_sent is None or now - last_switch_ts >= SERIAL_COOLDOWN_S):
             try:
-                ser.write((cmd + "\n").encode("utf-8"))
+                await asyncio.to_thread(ser.write, (cmd + "\n").encode("utf-8"))
                 print(f"→ sent {cmd}")
             except serial.SerialException as e:
                 print(f"[serial error] {e}")
@@ -224,15 +335,36 @@ def voice_loop():
                     ser.close()
                 except:
                     pass
-                ser = open_serial()
+                ser = await asyncio.to_thread(open_serial)
                 continue
 
             last_sent = cmd
             last_switch_ts = now
-            transition_to_mode(cmd)
+            await modes.put(cmd)
         else:
             print(f"(holding mode: {last_sent})")
 
-# Run the voice loop in the background
-threading.Thread(target=voice_loop, daemon=True).start()
+
+async def orchestrate():
+    texts, commands, modes = asyncio.Queue(), asyncio.Queue(), asyncio.Queue()
+    video = asyncio.create_task(video_task(modes))
+    await asyncio.gather(recognize_task(texts),
+                         classify_task(texts, commands),
+                         serial_task(commands, modes))
+    await modes.join()  # let the last transition finish
+    video.cancel()
+    print_reports()
+
+reports_printed = threading.Event()
+
+def print_reports():
+    # at the end of the text stand-in, or when the window is closed, whichever comes first
+    if not reports_printed.is_set():
+        reports_printed.set()
+        print(stt.report())
+        print(classifier.stats())
+
+# Run the event loop in the background, Tk keeps the main thread
+threading.Thread(target=lambda: asyncio.run(orchestrate()), daemon=True).start()
 root.mainloop()
+print_reports()
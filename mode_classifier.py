@@ -0,0 +1,156 @@
+# Fast path for classify_mode_local: repeated commands skip the SentenceTransformer.
+#
+#   PhraseIndex     training phrases (dataset.jsonl) -> label, answers exact and near-exact matches
+#                   (character trigram nearest neighbour) without any embedding
+#   EmbeddingCache  LRU of embeddings keyed on the normalised text
+#   ModeClassifier  index, then cache, then embedder + classifier, with hit metrics
+#
+# Requires:
+# pip install sentence-transformers scikit-learn numpy
+
+import re
+import json
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+_APOSTROPHES = str.maketrans("", "", "'’‘`")
+
+
+def normalize(text: str) -> str:
+    """Lowercase, no apostrophes (STT writes "im" as well as "I'm") nor punctuation, single spaces:
+    "I’m  tired!" -> "im tired"."""
+    text = text.translate(_APOSTROPHES).lower()
+    text = re.sub(r"[^\w ]+", " ", text)
+    return " ".join(text.split())
+
+
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class PhraseIndex:
+    """Nearest training phrase of an utterance, by Jaccard similarity of character trigrams.
+
+    Args:
+        phrases: (text, label) pairs. Texts that normalise the same but have different labels are left out.
+        min_similarity: a near match below this similarity is not trusted, the model decides instead.
+    """
+
+    def __init__(self, phrases, min_similarity=0.8):
+        self.min_similarity = min_similarity
+        labels = defaultdict(set)
+        for text, label in phrases:
+            labels[normalize(text)].add(label)
+        self.exact = {text: ls.pop() for text, ls in labels.items() if len(ls) == 1}
+
+        self.texts = list(self.exact)
+        self.grams = [trigrams(t) for t in self.texts]
+        self.postings = defaultdict(list)  # trigram -> phrases having it
+        for i, grams in enumerate(self.grams):
+            for g in grams:
+                self.postings[g].append(i)
+
+    @classmethod
+    def from_jsonl(cls, path, **kwargs):
+        """Build from the training file: one {"text": ..., "label": ...} per line."""
+        phrases = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    j = json.loads(line)
+                    phrases.append((j["text"], j["label"]))
+        return cls(phrases, **kwargs)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def lookup(self, text: str):
+        """(label, similarity) of the matching training phrase, None when there is no close enough one.
+        `text` must be normalised."""
+        if text in self.exact:
+            return self.exact[text], 1.0
+
+        grams = trigrams(text)
+        shared = defaultdict(int)
+        for g in grams:
+            for i in self.postings.get(g, ()):
+                shared[i] += 1
+        best, best_sim, labels = None, 0.0, set()
+        for i, n in shared.items():
+            sim = n / (len(grams) + len(self.grams[i]) - n)
+            if sim > best_sim:
+                best, best_sim, labels = i, sim, {self.exact[self.texts[i]]}
+            elif sim == best_sim:
+                labels.add(self.exact[self.texts[i]])
+        if best is None or best_sim < self.min_similarity or len(labels) > 1:
+            return None
+        return self.exact[self.texts[best]], best_sim
+
+
+class EmbeddingCache:
+    """LRU cache of embedder.encode() for single texts, keyed on the normalised text."""
+
+    def __init__(self, embedder, maxsize=256):
+        self.embedder = embedder
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, text: str) -> np.ndarray:
+        key = normalize(text)
+        vec = self.items.get(key)
+        if vec is not None:
+            self.items.move_to_end(key)
+            self.hits += 1
+            return vec
+        self.misses += 1
+        vec = self.embedder.encode([text])[0]
+        self.items[key] = vec
+        if len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+        return vec
+
+    def __len__(self):
+        return len(self.items)
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class ModeClassifier:
+    """Label and confidence of an utterance: from the phrase index if it knows the phrase,
+    else from the classifier on the (cached) embedding.
+
+    Args:
+        embedder: SentenceTransformer of the training.
+        clf: classifier with predict_proba, trained on the embedder vectors.
+        index: PhraseIndex of the training phrases, None to always use the model.
+        cache_size: embeddings kept in the LRU cache.
+    """
+
+    def __init__(self, embedder, clf, index: PhraseIndex | None = None, cache_size=256):
+        self.clf = clf
+        self.index = index
+        self.cache = EmbeddingCache(embedder, cache_size)
+        self.index_hits = 0
+        self.calls = 0
+
+    def predict(self, text: str):
+        """(label, confidence, source), source is "phrase" or "model"."""
+        self.calls += 1
+        if self.index is not None:
+            match = self.index.lookup(normalize(text))
+            if match is not None:
+                self.index_hits += 1
+                return int(match[0]), match[1], "phrase"
+        probs = self.clf.predict_proba(self.cache.encode(text)[None])[0]
+        return int(np.argmax(probs)), float(np.max(probs)), "model"
+
+    def stats(self) -> str:
+        index = f"phrase index {self.index_hits}/{self.calls} hits" if self.index is not None else "no phrase index"
+        return (f"[classifier] {index}, embedding cache {len(self.cache)}/{self.cache.maxsize} "
+                f"hit rate {self.cache.hit_rate() * 100:.1f}% ({self.cache.hits} hits, {self.cache.misses} misses)")
@@ -0,0 +1,229 @@
+# Speech-to-text backends for the voice loops, behind one interface:
+#   stt.transcribe(audio) -> text, raising sr.UnknownValueError / sr.RequestError like the sr recognizers.
+#
+#   google          Google Web Speech (network), what the loops used before
+#   vosk[:path]     offline Vosk model, default path VOSK_MODEL
+#   text:path       stand-in returning the lines of a text file in order, no microphone needed
+#   a+b             try a, and b when a cannot be reached (e.g. google+vosk)
+#
+# Every backend keeps a latency histogram of its calls, see report().
+#
+# Requires:
+# pip install speechrecognition vosk   (vosk only for the offline backend)
+
+import os
+import json
+import time
+import bisect
+import http.client
+import speech_recognition as sr
+
+VOSK_MODEL = "vosk-model-small-en-us-0.15"
+
+
+class LatencyHistogram:
+    """Counts of call durations in fixed millisecond bins."""
+
+    BINS_MS = [50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BINS_MS) + 1)  # last bin: above the largest bound
+        self.samples = []
+
+    def add(self, seconds: float):
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.BINS_MS, ms)] += 1
+        self.samples.append(ms)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def percentile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+    def format(self, width=30) -> str:
+        lines = [f"n={len(self)}  p50={self.percentile(50):.0f}ms  p95={self.percentile(95):.0f}ms"]
+        top = max(self.counts) or 1
+        for i, n in enumerate(self.counts):
+            if not n:
+                continue
+            label = f"<= {self.BINS_MS[i]}ms" if i < len(self.BINS_MS) else f"> {self.BINS_MS[-1]}ms"
+            lines.append(f"  {label:>10} {n:5d} {'#' * max(1, n * width // top)}")
+        return "\n".join(lines)
+
+
+class STTBackend:
+    """Base of the backends: subclasses implement _transcribe(audio)."""
+
+    name = "stt"
+    needs_audio = True  # False: transcribe() ignores the audio, the caller can skip the microphone
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.errors = 0
+
+    def transcribe(self, audio: sr.AudioData | None) -> str:
+        start = time.perf_counter()
+        try:
+            return self._transcribe(audio)
+        except sr.RequestError:
+            self.errors += 1
+            raise
+        finally:
+            self.latency.add(time.perf_counter() - start)
+
+    def _transcribe(self, audio):
+        raise NotImplementedError
+
+    def backends(self):
+        return [self]
+
+    def report(self) -> str:
+        return "\n".join(f"[stt] {b.name} ({b.errors} errors): {b.latency.format()}" for b in self.backends())
+
+
+class GoogleBackend(STTBackend):
+    """Google Web Speech API through speech_recognition. timeout bounds the wait when the network is bad."""
+
+    name = "google"
+
+    def __init__(self, rec: sr.Recognizer | None = None, timeout=3.0):
+        super().__init__()
+        self.rec = rec if rec is not None else sr.Recognizer()
+        self.rec.operation_timeout = timeout
+
+    def _transcribe(self, audio):
+        try:
+            return self.rec.recognize_google(audio)
+        except (OSError, http.client.HTTPException) as e:
+            # speech_recognition only wraps URLError / HTTPError, a timeout or a dropped
+            # connection while reading the response comes out raw
+            raise sr.RequestError(f"connection failed: {e!r}") from e
+
+
+class VoskBackend(STTBackend):
+    """Offline recognition with a Vosk model folder (https://alphacephei.com/vosk/models)."""
+
+    name = "vosk"
+
+    def __init__(self, model_path=VOSK_MODEL):
+        super().__init__()
+        try:
+            import vosk
+        except ImportError:
+            raise ImportError("The offline backend needs vosk: pip install vosk")
+        if not os.path.isdir(model_path):
+            raise FileNotFoundError(f"Vosk model folder not found: {model_path}")
+        vosk.SetLogLevel(-1)
+        self.vosk = vosk
+        self.model = vosk.Model(model_path)  # loaded once, a recognizer per utterance is cheap
+
+    def _transcribe(self, audio):
+        rec = self.vosk.KaldiRecognizer(self.model, 16000)
+        rec.AcceptWaveform(audio.get_raw_data(convert_rate=16000, convert_width=2))
+        text = json.loads(rec.FinalResult()).get("text", "")
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+
+class TextBackend(STTBackend):
+    """Deterministic stand-in: returns the given lines in order, raises EOFError after the last one.
+    An empty line behaves like an utterance that was not understood."""
+
+    name = "text"
+    needs_audio = False
+
+    def __init__(self, lines):
+        super().__init__()
+        self.lines = list(lines)
+        self.pos = 0
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls(line.rstrip("\n") for line in f if not line.startswith("#"))
+
+    def _transcribe(self, audio):
+        if self.pos >= len(self.lines):
+            raise EOFError("no more scripted utterances")
+        text = self.lines[self.pos].strip()
+        self.pos += 1
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+
+class FallbackBackend(STTBackend):
+    """Try the backends in order, going to the next one when a backend cannot be reached
+    (sr.RequestError). A failed backend is skipped for retry_s seconds, so a dead network
+    does not cost a timeout on every utterance."""
+
+    def __init__(self, backends, retry_s=30.0):
+        super().__init__()
+        self.chain = list(backends)
+        self.retry_s = retry_s
+        self.down_until = [0.0] * len(self.chain)
+        self.name = "+".join(b.name for b in self.chain)
+        self.needs_audio = any(b.needs_audio for b in self.chain)
+
+    def _transcribe(self, audio):
+        error = None
+        now = time.time()
+        for i, backend in enumerate(self.chain):
+            if now < self.down_until[i] and i < len(self.chain) - 1:
+                continue
+            try:
+                return backend.transcribe(audio)
+            except sr.RequestError as e:
+                print(f"[stt] {backend.name} unavailable ({e}), skipping it for {self.retry_s:.0f}s")
+                self.down_until[i] = now + self.retry_s
+                error = e
+        raise error
+
+    def backends(self):
+        return [self] + self.chain
+
+
+def make_backend(spec: str, rec: sr.Recognizer | None = None) -> STTBackend:
+    """Build a backend from a spec like "google", "vosk:models/en", "text:commands.txt" or "google+vosk"."""
+    parts = [p.strip() for p in spec.split("+")]
+    if len(parts) > 1:
+        return FallbackBackend([make_backend(p, rec) for p in parts])
+    kind, _, arg = spec.partition(":")
+    if kind == "google":
+        return GoogleBackend(rec)
+    if kind == "vosk":
+        return VoskBackend(arg or VOSK_MODEL)
+    if kind == "text":
+        return TextBackend.from_file(arg)
+    raise ValueError(f"Unknown speech backend: {spec}")
+
+
+if __name__ == "__main__":
+    # Benchmark backends on recorded utterances without a microphone:
+    #   python speech_backends.py --backend vosk recordings/*.wav
+    import argparse
+
+    par = argparse.ArgumentParser(description="Transcribe WAV files and report the latency of a speech backend.")
+    par.add_argument("files", nargs="+", help="WAV/AIFF/FLAC utterances.")
+    par.add_argument("--backend", default="google+vosk", help="Backend spec, see the top of this file.")
+    par.add_argument("--repeat", type=int, default=1, help="Times to transcribe each file.")
+    args = par.parse_args()
+
+    stt = make_backend(args.backend)
+    for path in args.files:
+        with sr.AudioFile(path) as source:
+            audio = sr.Recognizer().record(source)
+        for _ in range(args.repeat):
+            try:
+                text = stt.transcribe(audio)
+            except sr.UnknownValueError:
+                text = "(couldn't understand)"
+            except sr.RequestError as e:
+                text = f"(speech service error: {e})"
+        print(f"{os.path.basename(path)}: {text}")
+    print(stt.report())
@@ -0,0 +1,141 @@
+# Continuous microphone capture for the voice loops.
+# One long-lived input stream is read by a background thread. The ambient noise
+# floor is tracked from the non-speech chunks while listening (no calibration
+# pause before each command), utterances are cut by an energy detector, and every
+# finished utterance goes to a queue for recognition.
+#
+# Requires:
+# pip install speechrecognition pyaudio numpy
+
+import time
+import queue
+import threading
+from collections import deque, namedtuple
+
+import numpy as np
+import speech_recognition as sr
+
+# audio: sr.AudioData, ready for the recognizers. start/end: time.time() of the first/last chunk.
+Utterance = namedtuple("Utterance", ["audio", "start", "end"])
+
+
+class SpeechStream:
+    """Segment a live microphone into utterances.
+
+    Args:
+        mic: sr.Microphone to keep open, default microphone if None.
+        pre_roll: seconds of audio kept before the detected start of speech, so the first word is not cut.
+        pause: seconds of silence that end an utterance (like sr.Recognizer.pause_threshold).
+        phrase_limit: longest utterance in seconds, it is cut there.
+        min_phrase: shorter utterances are dropped as noise.
+        ratio: a chunk is speech when its energy is above ratio * noise floor ...
+        min_energy: ... and above this absolute energy (16-bit RMS).
+        adapt: weight of each non-speech chunk in the running noise floor.
+        max_pending: utterances waiting for recognition, the oldest is dropped when full.
+    """
+
+    def __init__(self, mic=None, pre_roll=0.3, pause=0.8, phrase_limit=8, min_phrase=0.25,
+                 ratio=3.0, min_energy=150, adapt=0.05, max_pending=4):
+        self.mic = mic if mic is not None else sr.Microphone()
+        self.pre_roll = pre_roll
+        self.pause = pause
+        self.phrase_limit = phrase_limit
+        self.min_phrase = min_phrase
+        self.ratio = ratio
+        self.min_energy = min_energy
+        self.adapt = adapt
+
+        self.segments = queue.Queue(maxsize=max_pending)
+        self.noise_floor = None
+        self.dropped = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+
+    def get(self, timeout=None) -> Utterance | None:
+        """Next finished utterance, None on timeout."""
+        try:
+            return self.segments.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def is_speech(self, energy: float) -> bool:
+        return energy > max(self.noise_floor * self.ratio, self.min_energy)
+
+    @staticmethod
+    def energy(chunk: bytes) -> float:
+        """RMS of a chunk of 16-bit samples (sr.Microphone always records paInt16)."""
+        samples = np.frombuffer(chunk, dtype=np.int16).astype(np.float32)
+        return float(np.sqrt(np.mean(samples * samples))) if samples.size else 0.0
+
+    def _emit(self, chunks, width, rate, start, end):
+        utt = Utterance(sr.AudioData(b"".join(chunks), rate, width), start, end)
+        while True:
+            try:
+                self.segments.put_nowait(utt)
+                return
+            except queue.Full:
+                # recognition is behind: the oldest command is the least relevant one
+                try:
+                    self.segments.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _run(self):
+        with self.mic as source:
+            rate, width, size = source.SAMPLE_RATE, source.SAMPLE_WIDTH, source.CHUNK
+            chunk_s = size / rate
+            pre_chunks = int(round(self.pre_roll / chunk_s))
+            ring = deque(maxlen=pre_chunks + 2)  # audio before the speech start
+            phrase, energies = [], []
+            start = 0.0
+            voiced = 0   # consecutive speech chunks before the start
+            silent = 0   # consecutive silent chunks inside an utterance
+            print("[mic] listening continuously...")
+
+            while not self.stopped.is_set():
+                chunk = source.stream.read(size)
+                now = time.time()
+                energy = self.energy(chunk)
+                if self.noise_floor is None:
+                    self.noise_floor = energy
+
+                if not phrase:
+                    ring.append(chunk)
+                    if self.is_speech(energy):
+                        voiced += 1
+                        if voiced >= 2:  # two chunks in a row, a single click is not speech
+                            phrase = list(ring)
+                            energies = [energy] * len(ring)
+                            start = now - len(ring) * chunk_s
+                            silent = 0
+                    else:
+                        voiced = 0
+                        self.noise_floor += self.adapt * (energy - self.noise_floor)
+                    continue
+
+                phrase.append(chunk)
+                energies.append(energy)
+                silent = 0 if self.is_speech(energy) else silent + 1
+                duration = len(phrase) * chunk_s
+                if silent * chunk_s >= self.pause or duration >= self.phrase_limit:
+                    # keep a bit of the trailing silence, like sr.Recognizer.listen
+                    keep = len(phrase) - max(0, silent - pre_chunks)
+                    if (len(phrase) - silent) * chunk_s >= self.min_phrase:
+                        self._emit(phrase[:keep], width, rate, start, now)
+                    if silent == 0:
+                        # no pause in a whole phrase: the background got louder, not someone talking
+                        self.noise_floor = max(self.noise_floor, float(np.percentile(energies, 10)))
+                    phrase = []
+                    voiced = 0
+                    ring.clear()